@@ -0,0 +1,65 @@
+"""
+对比内置SVG渲染器与flamegraph.pl的火焰图生成耗时
+
+python bench_render.py --ranks 1000 --flamegraph-bin /path/to/flamegraph.pl
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+from framegraph_generator import FlameGraphGenerator
+from tire_stack import merge_stacks
+
+
+def make_stacks(ranks: int, depth: int, groups: int, seed: int = 0):
+    """生成ranks条堆栈, 前段共享, 后段分成groups种分支"""
+    rng = random.Random(seed)
+    common = [f"_PyEval_EvalFrameDefault (/usr/local/src/conda/python-3.10.16/Python/ceval.c:{4000 + i})"
+              for i in range(depth // 2)]
+    branches = []
+    for group in range(groups):
+        branch = []
+        for i in range(depth - len(common)):
+            if i % 3 == 0:
+                branch.append(f"forward_{group}_{i} (/opt/conda/lib/python3.10/site-packages/model.py:{i})")
+            else:
+                branch.append(f"c10::impl::op_{group}_{i}() (:0)")
+        branches.append(branch)
+    return [";".join(common + rng.choice(branches)) + ";" for _ in range(ranks)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="火焰图渲染性能对比")
+    parser.add_argument("--ranks", type=int, default=1000)
+    parser.add_argument("--depth", type=int, default=120)
+    parser.add_argument("--groups", type=int, default=50, help="不同堆栈分支的数量")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--flamegraph-bin", default=None, help="flamegraph.pl路径, 为空时只测内置渲染器")
+    args = parser.parse_args()
+
+    trie = merge_stacks(make_stacks(args.ranks, args.depth, args.groups))
+    with tempfile.TemporaryDirectory() as tmp:
+        svg_path = os.path.join(tmp, "flamegraph.svg")
+        folded_path = os.path.join(tmp, "stacks.txt")
+        candidates = [("builtin", None)]
+        if args.flamegraph_bin and os.path.exists(args.flamegraph_bin):
+            candidates.append(("flamegraph.pl", args.flamegraph_bin))
+        else:
+            print("未找到flamegraph.pl, 跳过对比")
+
+        for name, flamegraph_bin in candidates:
+            generator = FlameGraphGenerator(flamegraph_bin=flamegraph_bin, output_file=folded_path)
+            best = float("inf")
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                generator.generate_flamegraph(svg_path, trie=trie)
+                best = min(best, time.perf_counter() - start)
+            print(f"{name:>14}: {best * 1000:8.1f} ms  ({os.path.getsize(svg_path) / 1024:.0f} KiB)")
+
+
+if __name__ == "__main__":
+    main()
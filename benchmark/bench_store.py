@@ -0,0 +1,82 @@
+"""
+测量快照时序库的写入速度、磁盘占用与查询耗时
+
+python bench_store.py --ranks 1000 --samples 86400 --churn 0.05
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+from snapshot_store import SnapshotStore
+
+
+def make_stack_pool(depth: int, variants: int, seed: int = 0):
+    """训练循环中各rank可能处于的堆栈, 最后一种停在all_reduce"""
+    rng = random.Random(seed)
+    common = [f"_PyEval_EvalFrameDefault (/usr/local/src/conda/python-3.10.16/Python/ceval.c:{4000 + i})"
+              for i in range(depth // 2)]
+    pool = []
+    for variant in range(variants):
+        tail = [f"step_{variant}_{i} (/opt/conda/lib/python3.10/site-packages/model.py:{rng.randint(1, 2000)})"
+                for i in range(depth - len(common) - 1)]
+        pool.append(";".join(common + tail) + ";")
+    pool.append(";".join(common + ["all_reduce (/opt/conda/lib/python3.10/site-packages/torch/distributed/"
+                                   "distributed_c10d.py:2050)"]) + ";")
+    return pool
+
+
+def timed(name, func):
+    start = time.perf_counter()
+    result = func()
+    print(f"{name:<28} {time.perf_counter() - start:8.3f}s")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="快照时序库性能测试")
+    parser.add_argument("--ranks", type=int, default=1000)
+    parser.add_argument("--samples", type=int, default=3600, help="样本数, 每秒一个样本")
+    parser.add_argument("--depth", type=int, default=120)
+    parser.add_argument("--variants", type=int, default=200, help="不同堆栈的数量")
+    parser.add_argument("--churn", type=float, default=0.05, help="每个样本中堆栈变化的rank比例")
+    parser.add_argument("--segment-samples", type=int, default=600)
+    parser.add_argument("--store", default=None, help="快照库目录, 默认使用临时目录")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    pool = make_stack_pool(args.depth, args.variants)
+    stacks = [rng.choice(pool) for _ in range(args.ranks)]
+    start_time = 1.7e9
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.store or os.path.join(tmp, "store")
+        store = SnapshotStore(path, num_ranks=args.ranks, segment_samples=args.segment_samples)
+
+        def append_all():
+            for index in range(args.samples):
+                for _ in range(int(args.ranks * args.churn)):
+                    stacks[rng.randrange(args.ranks)] = rng.choice(pool)
+                store.append(list(stacks), start_time + index)
+
+        timed(f"append {args.samples} samples", append_all)
+        store.close()
+        print(f"{'disk usage':<28} {store.disk_usage() / 2 ** 20:8.1f} MiB "
+              f"(原始堆栈 {sum(map(len, stacks)) * args.samples / 2 ** 30:.1f} GiB)")
+
+        store = timed("open", lambda: SnapshotStore(path))
+        middle = start_time + args.samples // 2
+        timed("aggregate 15min", lambda: store.aggregate(middle, middle + 900))
+        timed("aggregate all", lambda: store.aggregate())
+        runs = timed("dwell all_reduce >= 30", lambda: store.dwell("all_reduce", 30))
+        timed("rank timeline", lambda: store.rank_timeline(args.ranks // 2))
+        timed("stacks at", lambda: store.stacks_at(middle))
+        print(f"{len(runs)} runs >= 30 samples in all_reduce")
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+本地模拟的probing服务, 每个rank对应一个路径:
+    http://127.0.0.1:<port>/rank/<rank>/apis/pythonext/callstack
+"""
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+
+from synthetic import SyntheticCluster
+
+CALLSTACK_PATH = "/apis/pythonext/callstack"
+
+
+class _Server(ThreadingHTTPServer):
+    # 大量并发连接时默认的listen队列(5)太短
+    request_queue_size = 1024
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # 客户端超时或取消备份请求后断开连接属于正常情况
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class FakeProbingServer:
+    def __init__(self, cluster: SyntheticCluster, host: str = "127.0.0.1", port: int = 0,
+                 latency: float = 0.0, jitter: float = 0.0, failure_rate: float = 0.0,
+                 hang_rate: float = 0.0, hang_seconds: float = 30.0, seed: int = 0):
+        """初始化模拟服务
+
+        Args:
+            cluster: 提供各rank堆栈的模拟集群
+            host: 监听地址
+            port: 监听端口, 为0时自动分配
+            latency: 每个请求的基础延迟(秒)
+            jitter: 在基础延迟上叠加的随机延迟上限(秒)
+            failure_rate: 返回500的请求比例
+            hang_rate: 长时间不响应的请求比例
+            hang_seconds: 不响应请求的挂起时间(秒)
+            seed: 随机种子
+        """
+        self.cluster = cluster
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.hang_rate = hang_rate
+        self.hang_seconds = hang_seconds
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        # 预先编码响应体, 避免服务端的序列化开销计入采集耗时
+        self._bodies = [cluster.rank_body(rank) for rank in range(cluster.ranks)]
+        self._server = _Server((host, port), self._make_handler())
+        self._thread = None
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def endpoints(self) -> List[str]:
+        host = self._server.server_address[0]
+        return [f"http://{host}:{self.port}/rank/{rank}{CALLSTACK_PATH}" for rank in range(self.cluster.ranks)]
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                parts = self.path.split("/")
+                if len(parts) < 3 or parts[1] != "rank" or not self.path.endswith(CALLSTACK_PATH):
+                    self.send_error(404)
+                    return
+                rank = int(parts[2])
+                with server._rng_lock:
+                    roll = server._rng.random()
+                    delay = server.latency + server._rng.random() * server.jitter
+                if roll < server.hang_rate:
+                    time.sleep(server.hang_seconds)
+                elif delay:
+                    time.sleep(delay)
+                if roll >= 1 - server.failure_rate:
+                    self.send_error(500, "injected failure")
+                    return
+                body = server._bodies[rank]
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> "FakeProbingServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,133 @@
+"""
+分阶段测量采集流水线的耗时与内存: fetch / parse / merge / traverse / render
+
+python run_bench.py --ranks 1024 --depth 120 --divergence 0.01 --latency 0.05 --memory
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+from collect_stack_info import StackCollector
+from framegraph_generator import FlameGraphGenerator
+from stream_parser import parse_frames
+from svg_renderer import FlameGraphRenderer
+from tire_stack import trie_from_groups
+
+from fake_server import FakeProbingServer
+from synthetic import SyntheticCluster
+
+_CHUNK_SIZE = 64 * 1024
+
+
+class StageRecorder:
+    def __init__(self, trace_memory: bool):
+        """记录各阶段的耗时与内存峰值
+
+        Args:
+            trace_memory: 是否用tracemalloc统计内存峰值(会拖慢执行)
+        """
+        self.trace_memory = trace_memory
+        self.results = []
+
+    @contextmanager
+    def stage(self, name: str, **extra):
+        if self.trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            yield extra
+        finally:
+            elapsed = time.perf_counter() - start
+            peak = None
+            if self.trace_memory:
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            # 引用同一个字典, 阶段结束后补充的信息也会出现在结果中
+            self.results.append({"stage": name, "seconds": elapsed, "peak_bytes": peak, "detail": extra})
+
+    def report(self) -> str:
+        lines = [f"{'stage':<10} {'time(ms)':>10} {'peak(MiB)':>10}  detail"]
+        for result in self.results:
+            peak = "-" if result["peak_bytes"] is None else f"{result['peak_bytes'] / 2 ** 20:.1f}"
+            detail = ", ".join(f"{key}={value}" for key, value in result["detail"].items())
+            lines.append(f"{result['stage']:<10} {result['seconds'] * 1000:>10.1f} {peak:>10}  {detail}")
+        return "\n".join(lines)
+
+
+def run(args) -> StageRecorder:
+    cluster = SyntheticCluster(ranks=args.ranks, depth=args.depth, divergence=args.divergence,
+                               variants=args.variants, locals_size=args.locals_size, seed=args.seed)
+    recorder = StageRecorder(args.memory)
+
+    with FakeProbingServer(cluster, latency=args.latency, jitter=args.jitter,
+                           failure_rate=args.failure_rate, hang_rate=args.hang_rate) as server:
+        collector = StackCollector(timeout=args.timeout, max_per_host=args.max_per_host, deadline=args.deadline,
+                                   retries=args.retries, hedge_after=args.hedge_after)
+        with recorder.stage("fetch") as extra:
+            stack_data = collector.collect_from_multiple_endpoints(server.endpoints(), max_workers=args.max_workers)
+        latencies = sorted(stat["latency"] for stat in collector.endpoint_stats if stat["latency"] is not None)
+        for stat in collector.endpoint_stats:
+            extra[stat["status"]] = extra.get(stat["status"], 0) + 1
+        if latencies:
+            extra["p50_ms"] = round(latencies[len(latencies) // 2] * 1000, 1)
+            extra["max_ms"] = round(latencies[-1] * 1000, 1)
+
+    bodies = [cluster.rank_body(rank) for rank in range(args.ranks)]
+    with recorder.stage("parse", bytes=sum(len(body) for body in bodies)):
+        for body in bodies:
+            parse_frames(body[i:i + _CHUNK_SIZE] for i in range(0, len(body), _CHUNK_SIZE))
+    with recorder.stage("json.loads"):
+        for body in bodies:
+            json.loads(body)
+    del bodies
+
+    with recorder.stage("merge", workers=args.merge_workers) as extra:
+        groups, failed = FlameGraphGenerator.group_stack_data(stack_data, workers=args.merge_workers)
+        trie = trie_from_groups(groups, len(stack_data), failed)
+    extra["unique_stacks"] = sum(1 for stack in groups if stack)
+
+    with open(os.devnull, "w") as devnull:
+        with recorder.stage("traverse"):
+            trie.dump(devnull)
+        with recorder.stage("render"):
+            FlameGraphRenderer().render(trie, devnull)
+    return recorder
+
+
+def main():
+    parser = argparse.ArgumentParser(description="采集流水线分阶段性能测试")
+    parser.add_argument("--ranks", type=int, default=1024)
+    parser.add_argument("--depth", type=int, default=120)
+    parser.add_argument("--divergence", type=float, default=0.01, help="与多数rank堆栈不同的rank比例")
+    parser.add_argument("--variants", type=int, default=8, help="不同堆栈分支的种类数")
+    parser.add_argument("--locals-size", type=int, default=8, help="每个PyFrame的locals变量个数")
+    parser.add_argument("--latency", type=float, default=0.0, help="模拟服务的基础延迟(秒)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="模拟服务的随机延迟上限(秒)")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="模拟服务返回500的比例")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="模拟服务长时间不响应的比例")
+    parser.add_argument("--timeout", type=float, default=10)
+    parser.add_argument("--deadline", type=float, default=None, help="一次快照的总时限(秒)")
+    parser.add_argument("--retries", type=int, default=1)
+    parser.add_argument("--hedge-after", type=float, default=None, help="请求超过该时间(秒)未返回时发出备份请求")
+    parser.add_argument("--max-workers", type=int, default=256)
+    parser.add_argument("--max-per-host", type=int, default=256)
+    parser.add_argument("--merge-workers", type=int, default=1, help="合并阶段使用的进程数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--memory", action="store_true", help="用tracemalloc统计各阶段内存峰值")
+    parser.add_argument("--json", default=None, help="把结果另存为JSON文件")
+    args = parser.parse_args()
+
+    recorder = run(args)
+    print(recorder.report())
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "stages": recorder.results}, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
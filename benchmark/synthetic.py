@@ -0,0 +1,74 @@
+"""
+生成模拟集群的堆栈数据, 格式与probing的 /apis/pythonext/callstack 一致
+"""
+import json
+import random
+from typing import Any, Dict, List
+
+
+class SyntheticCluster:
+    def __init__(self, ranks: int = 1024, depth: int = 120, divergence: float = 0.01,
+                 variants: int = 8, locals_size: int = 8, seed: int = 0):
+        """初始化模拟集群
+
+        Args:
+            ranks: rank数量
+            depth: 每个rank的堆栈深度
+            divergence: 堆栈与大多数rank不同的rank比例
+            variants: 不同rank可能处于的分支种类数
+            locals_size: 每个PyFrame的locals变量个数
+            seed: 随机种子
+        """
+        self.ranks = ranks
+        self.depth = depth
+        self.divergence = divergence
+        self.locals_size = locals_size
+        rng = random.Random(seed)
+        self._rng = rng
+
+        # 底部共享的解释器/训练循环帧, 顶部为各分支不同的帧
+        common_depth = depth * 2 // 3
+        self._common = [self._frame(rng, "main", i) for i in range(common_depth)]
+        self._tails = [[self._frame(rng, f"branch{v}", i) for i in range(depth - common_depth)]
+                       for v in range(variants + 1)]
+        self._assignment = [0 if rng.random() >= divergence else rng.randint(1, variants)
+                            for _ in range(ranks)]
+
+    def _frame(self, rng: random.Random, prefix: str, index: int) -> Dict[str, Any]:
+        kind = rng.random()
+        if kind < 0.4:
+            return {"PyFrame": {
+                "file": f"/opt/conda/lib/python3.10/site-packages/torch/{prefix}/module_{index % 17}.py",
+                "func": f"{prefix}_forward_{index}",
+                "lineno": rng.randint(1, 2000),
+                "locals": {
+                    f"var_{j}": {"id": rng.getrandbits(47), "class": "builtins.int", "shape": None,
+                                 "dtype": None, "device": None, "value": str(rng.getrandbits(32))}
+                    for j in range(self.locals_size)
+                },
+            }}
+        if kind < 0.7:
+            return {"CFrame": {
+                "ip": hex(rng.getrandbits(40)),
+                "file": "",
+                "func": f"void pybind11::cpp_function::initialize<{prefix}_{index}>(pybind11::detail::function_call&)",
+                "lineno": 0,
+            }}
+        return {"CFrame": {
+            "ip": hex(rng.getrandbits(40)),
+            "file": "/usr/local/src/conda/python-3.10.16/Python/ceval.c",
+            "func": f"_PyEval_EvalFrame_{prefix}_{index}",
+            "lineno": rng.randint(1, 6000),
+        }}
+
+    def rank_frames(self, rank: int) -> List[Dict[str, Any]]:
+        """rank的帧列表, 栈顶在前"""
+        return list(reversed(self._common + self._tails[self._assignment[rank]]))
+
+    def rank_body(self, rank: int) -> bytes:
+        """rank的HTTP响应体"""
+        return json.dumps(self.rank_frames(rank)).encode("utf-8")
+
+    def stack_data(self) -> List[List[Dict[str, Any]]]:
+        """所有rank的帧列表"""
+        return [self.rank_frames(rank) for rank in range(self.ranks)]
@@ -0,0 +1,105 @@
+import argparse
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+
+import sys
+sys.path.append(".")
+from collect_stack_info import StackCollector
+from frame_normalizer import FrameNormalizer
+from framegraph_generator import FlameGraphGenerator
+from tire_stack import stacks_to_partial
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+PARTIAL_PATH = "/apis/stackagg/partial"
+
+
+class NodeAggregator:
+    def __init__(self, endpoints: List[str], ranks: List[int], collector: StackCollector,
+                 max_workers: int = 64, normalizer=None):
+        """初始化单节点的聚合代理
+
+        Args:
+            endpoints: 本节点各rank的端点URL
+            ranks: 各端点对应的全局rank
+            collector: 堆栈收集器
+            max_workers: 全局最大并发请求数
+            normalizer: 帧标签规范化器, 在节点上规范化可以减小上报的部分结果
+        """
+        if len(endpoints) != len(ranks):
+            raise ValueError("endpoints与ranks的数量不一致")
+        self.endpoints = endpoints
+        self.ranks = ranks
+        self.collector = collector
+        self.max_workers = max_workers
+        self.normalizer = normalizer
+        # 同一时刻只做一次本地采集, 并发的上层请求排队等待
+        self._lock = threading.Lock()
+
+    def collect_partial(self) -> Dict[str, Any]:
+        """采集本节点所有rank并预合并
+
+        Returns:
+            stacks_to_partial格式的部分结果
+        """
+        with self._lock:
+            stack_data = self.collector.collect_from_multiple_endpoints(self.endpoints, max_workers=self.max_workers)
+        stacks = FlameGraphGenerator.stack_data_to_rank_stacks(stack_data, self.normalizer)
+        failed = [self.ranks[index] for index in FlameGraphGenerator.failed_ranks(stack_data)]
+        return stacks_to_partial(stacks, self.ranks, failed_ranks=failed)
+
+
+def make_handler(aggregator: NodeAggregator):
+    class AggregatorHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            if self.path != PARTIAL_PATH:
+                self.send_error(404)
+                return
+            try:
+                body = json.dumps(aggregator.collect_partial(), separators=(",", ":")).encode("utf-8")
+            except Exception as e:
+                logger.error(f"本地采集失败: {str(e)}", exc_info=True)
+                self.send_error(500, str(e))
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    return AggregatorHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="单节点堆栈聚合代理")
+    parser.add_argument("--config", required=True, help="本节点的配置文件路径")
+    parser.add_argument("--host", default="0.0.0.0", help="监听地址")
+    parser.add_argument("--port", type=int, default=9930, help="监听端口")
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as f:
+        config = json.load(f)
+    endpoints = config.get("endpoints", [])
+    rank_offset = config.get("rank_offset", 0)
+    ranks = config.get("ranks", list(range(rank_offset, rank_offset + len(endpoints))))
+
+    collector = StackCollector.from_config(config)
+    aggregator = NodeAggregator(endpoints, ranks, collector, max_workers=config.get("max_workers", 64),
+                                normalizer=FrameNormalizer.from_config(config))
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(aggregator))
+    logger.info(f"聚合代理已启动: http://{args.host}:{args.port}{PARTIAL_PATH}, 负责 {len(endpoints)} 个rank")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
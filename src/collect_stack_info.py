@@ -1,22 +1,63 @@
+import asyncio
 import requests
 import json
 import time
 import logging
-from concurrent.futures import ProcessPoolExecutor
 from typing import List, Dict, Any
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from stream_parser import FrameStreamParser, parse_frames
+from tire_stack import format_rank_ranges, ranks_to_mask
+
+# 流式读取响应体时每次读取的字节数
+_CHUNK_SIZE = 64 * 1024
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 class StackCollector:
-    def __init__(self, timeout: int = 10):
+    def __init__(self, timeout: int = 10, max_per_host: int = 8, keepalive_timeout: int = 30,
+                 keep_locals: bool = False, deadline: float = None, retries: int = 1,
+                 retry_backoff: float = 0.2, hedge_after: float = None):
         """初始化堆栈收集器
         
         Args:
-            timeout: 请求超时时间(秒)
+            timeout: 单次请求超时时间(秒)
+            max_per_host: 单个主机的最大并发请求数, 同一主机名不同端口的端点合并计数
+            keepalive_timeout: 连接池中空闲长连接的保持时间(秒)
+            keep_locals: 是否保留PyFrame中的locals, 默认在解析时直接丢弃
+            deadline: 一次快照的总时限(秒), 到期后未完成的rank记为timeout, 为空时不限制
+            retries: 请求失败后的最大重试次数
+            retry_backoff: 第一次重试前的等待时间(秒), 之后每次翻倍
+            hedge_after: 请求超过该时间(秒)仍未返回时, 并发发出一个备份请求, 先返回者为准; 为空时不发备份请求
         """
         self.timeout = timeout
+        self.keep_locals = keep_locals
+        self.max_per_host = max_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.deadline = deadline
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.hedge_after = hedge_after
+        # 下标与端点列表一致: {endpoint, status(ok/timeout/error), latency, attempts, bytes, error}
+        self.endpoint_stats: List[Dict[str, Any]] = []
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any], **kwargs) -> "StackCollector":
+        """根据config.json中的采集参数创建收集器, kwargs中的参数优先"""
+        options = {
+            "timeout": config.get("timeout", 10),
+            "max_per_host": config.get("max_per_host", 8),
+            "deadline": config.get("deadline"),
+            "retries": config.get("retries", 1),
+            "retry_backoff": config.get("retry_backoff", 0.2),
+            "hedge_after": config.get("hedge_after"),
+        }
+        options.update(kwargs)
+        return cls(**options)
         
     def fetch_stack_data(self, endpoint: str) -> Dict[str, Any]:
         """从单个端点获取堆栈数据
@@ -32,27 +73,225 @@ class StackCollector:
         """
         try:
             logger.info(f"正在从 {endpoint} 获取堆栈数据")
-            response = requests.get(endpoint, timeout=self.timeout)
-            response.raise_for_status()  # 检查请求是否成功
-            return response.json()
+            with requests.get(endpoint, timeout=self.timeout, stream=True) as response:
+                response.raise_for_status()  # 检查请求是否成功
+                return parse_frames(response.iter_content(_CHUNK_SIZE), keep_locals=self.keep_locals)
         except Exception as e:
             logger.error(f"从 {endpoint} 获取数据失败: {str(e)}")
-            return {"error": str(e), "endpoint": endpoint}
+            status = "timeout" if isinstance(e, requests.Timeout) else "error"
+            return {"error": str(e), "endpoint": endpoint, "status": status}
+
+    async def _request_once(self, session: aiohttp.ClientSession, endpoint: str,
+                            global_limit: asyncio.Semaphore, host_limit: asyncio.Semaphore,
+                            reader, deadline: float, stat: Dict[str, Any]):
+        """发出一次请求, 超时时间不超过快照的剩余时限"""
+        async with global_limit, host_limit:
+            # 拿到并发名额后再计时, 排队时间不计入延迟和超时
+            stat.setdefault("started", time.perf_counter())
+            stat["attempts"] += 1
+            timeout = self.timeout
+            if deadline is not None:
+                timeout = min(timeout, deadline - time.monotonic())
+                if timeout <= 0:
+                    raise asyncio.TimeoutError("快照时限已到")
+            async with session.get(endpoint, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                response.raise_for_status()
+                result = await reader(response)
+                stat["bytes"] = response.content.total_bytes
+                return result
+
+    async def _hedged_request(self, request):
+        """发出请求, 超过hedge_after仍未返回时再发一个备份请求, 返回最先成功的结果"""
+        tasks = [asyncio.ensure_future(request())]
+        hedged = self.hedge_after is None
+        try:
+            while True:
+                done, _ = await asyncio.wait(tasks, timeout=None if hedged else self.hedge_after,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    tasks.append(asyncio.ensure_future(request()))
+                    continue
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                pending = [task for task in tasks if not task.done()]
+                if not pending:
+                    raise done.pop().exception()
+                tasks = pending
+        finally:
+            for task in tasks:
+                task.cancel()
     
-    def collect_from_multiple_endpoints(self, endpoints: List[str], max_workers: int = 5) -> List[Dict[str, Any]]:
+    async def _fetch_stack_data_async(self, session: aiohttp.ClientSession, index: int, endpoint: str,
+                                      global_limit: asyncio.Semaphore,
+                                      host_limit: asyncio.Semaphore, reader,
+                                      deadline: float = None) -> Dict[str, Any]:
+        """通过连接池异步获取单个端点的堆栈数据, 失败时按指数退避重试, 并记录状态与延迟
+        
+        Args:
+            session: 共享连接池的会话
+            index: 端点在列表中的下标, 状态记录到endpoint_stats[index]
+            endpoint: 数据接口URL
+            global_limit: 全局并发限制
+            host_limit: 端点所在主机的并发限制
+            reader: 读取并解析响应体的协程函数
+            deadline: 快照时限(time.monotonic()的时刻), 为空时不限制
+            
+        Returns:
+            包含堆栈信息的字典, 失败时返回带error与status字段的字典
+        """
+        stat = {"endpoint": endpoint, "status": "timeout", "latency": None, "attempts": 0, "bytes": 0,
+                "error": "快照时限已到"}
+        self.endpoint_stats[index] = stat
+
+        async def request():
+            return await self._request_once(session, endpoint, global_limit, host_limit, reader, deadline, stat)
+
+        try:
+            for retry in range(self.retries + 1):
+                try:
+                    result = await self._hedged_request(request)
+                    stat["status"], stat["error"] = "ok", None
+                    return result
+                except Exception as e:
+                    stat["status"] = "timeout" if isinstance(e, asyncio.TimeoutError) else "error"
+                    stat["error"] = f"{type(e).__name__}: {e}"
+                delay = self.retry_backoff * 2 ** retry
+                if retry == self.retries or (deadline is not None and time.monotonic() + delay >= deadline):
+                    break
+                await asyncio.sleep(delay)
+            logger.error(f"从 {endpoint} 获取数据失败: {stat['error']}")
+            return {"error": stat["error"], "endpoint": endpoint, "status": stat["status"]}
+        finally:
+            # 延迟从第一次请求拿到并发名额开始计算, 一直在排队的rank没有延迟
+            started = stat.pop("started", None)
+            if started is not None:
+                stat["latency"] = time.perf_counter() - started
+
+    async def _read_frames(self, response: aiohttp.ClientResponse) -> List[Dict[str, Any]]:
+        """边接收边解析帧列表, 不保留完整的响应体"""
+        parser = FrameStreamParser(keep_locals=self.keep_locals)
+        frames = []
+        async for chunk in response.content.iter_chunked(_CHUNK_SIZE):
+            frames.extend(parser.feed(chunk))
+        frames.extend(parser.close())
+        return frames
+
+    @staticmethod
+    async def _read_json(response: aiohttp.ClientResponse) -> Dict[str, Any]:
+        return await response.json(content_type=None)
+
+    async def collect_async(self, endpoints: List[str], max_workers: int = 64,
+                            reader=None) -> List[Dict[str, Any]]:
+        """使用asyncio并发从多个端点收集堆栈数据
+        
+        每个主机维护一个keep-alive连接池, 同时限制单主机与全局的并发请求数.
+        设置了deadline时, 到期仍未完成的请求被取消, 总耗时与慢端点的数量无关.
+        
+        Args:
+            endpoints: 端点URL列表
+            max_workers: 全局最大并发请求数
+            reader: 读取响应体的协程函数, 默认按帧列表流式解析
+            
+        Returns:
+            与endpoints顺序一致的堆栈信息列表, 失败的端点为带error与status字段的字典
+        """
+        reader = reader or self._read_frames
+        self.endpoint_stats = [None] * len(endpoints)
+        deadline = None if self.deadline is None else time.monotonic() + self.deadline
+        global_limit = asyncio.Semaphore(max_workers)
+        # 按主机名(不含端口)限流: 同一节点上每个rank监听不同端口, 仍共用一份并发额度.
+        # aiohttp的limit_per_host按 主机:端口 计数, 只限制单个rank的连接数
+        host_limits: Dict[str, asyncio.Semaphore] = {}
+        for endpoint in endpoints:
+            host = urlsplit(endpoint).hostname
+            if host not in host_limits:
+                host_limits[host] = asyncio.Semaphore(self.max_per_host)
+
+        connector = aiohttp.TCPConnector(limit=max_workers, limit_per_host=self.max_per_host,
+                                         keepalive_timeout=self.keepalive_timeout)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            tasks = [
+                asyncio.ensure_future(self._fetch_stack_data_async(
+                    session, index, endpoint, global_limit, host_limits[urlsplit(endpoint).hostname],
+                    reader, deadline))
+                for index, endpoint in enumerate(endpoints)
+            ]
+            if not tasks:
+                return []
+            _, pending = await asyncio.wait(
+                tasks, timeout=None if deadline is None else max(0.0, deadline - time.monotonic()))
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        results = []
+        for task, endpoint in zip(tasks, endpoints):
+            if task.cancelled():
+                results.append({"error": "快照时限已到", "endpoint": endpoint, "status": "timeout"})
+            else:
+                results.append(task.result())
+        return results
+
+    def collect_from_multiple_endpoints(self, endpoints: List[str], max_workers: int = 64) -> List[Dict[str, Any]]:
         """并行从多个端点收集堆栈数据
         
         Args:
             endpoints: 端点URL列表
-            max_workers: 最大并行进程数
+            max_workers: 全局最大并发请求数
             
         Returns:
             包含所有端点堆栈信息的列表
         """
-        with ProcessPoolExecutor(max_workers=max_workers) as executor:
-            results = list(executor.map(self.fetch_stack_data, endpoints))
+        start = time.perf_counter()
+        results = asyncio.run(self.collect_async(endpoints, max_workers=max_workers))
+        self.log_latency_report(time.perf_counter() - start)
         return results
-    
+
+    def collect_partials(self, aggregators: List[str], max_workers: int = 64) -> List[Dict[str, Any]]:
+        """从各节点的聚合代理收集预合并的堆栈
+        
+        Args:
+            aggregators: 聚合代理的URL列表
+            max_workers: 全局最大并发请求数
+            
+        Returns:
+            各节点的预合并结果, 失败时为带error字段的字典
+        """
+        start = time.perf_counter()
+        results = asyncio.run(self.collect_async(aggregators, max_workers=max_workers, reader=self._read_json))
+        self.log_latency_report(time.perf_counter() - start)
+        return results
+
+    def log_latency_report(self, elapsed: float) -> None:
+        """输出本次采集的端点状态与延迟统计
+        
+        Args:
+            elapsed: 本次采集的总耗时(秒)
+        """
+        if not self.endpoint_stats:
+            return
+        statuses: Dict[str, int] = {}
+        for stat in self.endpoint_stats:
+            statuses[stat["status"]] = statuses.get(stat["status"], 0) + 1
+        summary = ", ".join(f"{status} {count}" for status, count in statuses.items())
+        latencies = sorted(stat["latency"] for stat in self.endpoint_stats if stat["latency"] is not None)
+        if latencies:
+            slowest = max((stat for stat in self.endpoint_stats if stat["latency"] is not None),
+                          key=lambda stat: stat["latency"])
+            logger.info(f"采集完成: {len(self.endpoint_stats)} 个端点({summary}), 总耗时 {elapsed:.3f}s, "
+                        f"延迟 p50={latencies[len(latencies) // 2]:.3f}s max={latencies[-1]:.3f}s "
+                        f"(最慢端点 {slowest['endpoint']})")
+        else:
+            logger.info(f"采集完成: {len(self.endpoint_stats)} 个端点({summary}), 总耗时 {elapsed:.3f}s")
+        stragglers = [index for index, stat in enumerate(self.endpoint_stats) if stat["status"] == "timeout"]
+        if stragglers:
+            logger.warning(f"{len(stragglers)} 个端点超时: {format_rank_ranges(ranks_to_mask(stragglers))}")
+        for stat in self.endpoint_stats:
+            logger.debug(f"{stat['endpoint']} status={stat['status']} attempts={stat['attempts']} "
+                         f"latency={stat['latency']}")
+
     def save_to_json(self, data: List[Dict[str, Any]], filename: str) -> None:
         """将收集的数据保存到JSON文件
         
@@ -64,6 +303,17 @@ class StackCollector:
             json.dump(data, f, indent=4)
         logger.info(f"数据已保存到 {filename}")
 
+    def save_status(self, filename: str) -> None:
+        """将最近一次采集各rank的状态(ok/timeout/error)、延迟与请求次数保存到JSON文件
+        
+        Args:
+            filename: 目标文件名
+        """
+        status = [dict(stat, rank=rank) for rank, stat in enumerate(self.endpoint_stats)]
+        with open(filename, 'w') as f:
+            json.dump(status, f, indent=4)
+        logger.info(f"采集状态已保存到 {filename}")
+
 if __name__ == "__main__":
     # 示例使用
     endpoints = [
@@ -0,0 +1,126 @@
+import re
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Optional
+
+# 名称中的这些运算符含有尖括号, 不是模板参数
+_OPERATOR = re.compile(r"operator\s*(<=>|<<=|>>=|<<|>>|<=|>=|->\*|->|<|>)")
+_IDENTIFIER_CHAR = re.compile(r"[A-Za-z0-9_]")
+
+
+def collapse_template_args(name: str) -> str:
+    """把C++名称中最外层的模板参数折叠为 <...>
+
+    例如 pybind11::cpp_function::initialize<main_0, void>(...) 折叠为
+    pybind11::cpp_function::initialize<...>(...); operator< 等运算符与模板参数中括号内的比较运算符保持不变, 尖括号不配对时原样返回.
+    """
+    if "<" not in name:
+        return name
+    out = []
+    depth = 0
+    # 模板参数中的圆括号层数, 括号内的 < > 是比较运算符, 如 foo<(1>2)>
+    parens = 0
+    i = 0
+    length = len(name)
+    while i < length:
+        if name.startswith("operator", i) and (i == 0 or not _IDENTIFIER_CHAR.match(name[i - 1])):
+            match = _OPERATOR.match(name, i)
+            if match:
+                if depth == 0:
+                    out.append(match.group())
+                i = match.end()
+                continue
+        if name.startswith("->", i):
+            if depth == 0:
+                out.append("->")
+            i += 2
+            continue
+        ch = name[i]
+        if parens:
+            if ch == "(":
+                parens += 1
+            elif ch == ")":
+                parens -= 1
+        elif ch == "<":
+            if depth == 0:
+                out.append("<...>")
+            depth += 1
+        elif ch == ">" and depth:
+            depth -= 1
+        elif depth == 0:
+            out.append(ch)
+        elif ch == "(":
+            parens = 1
+        i += 1
+    if depth:
+        return name
+    return "".join(out)
+
+
+class FrameNormalizer:
+    def __init__(self, collapse_templates: bool = False, strip_prefixes: Iterable[str] = (),
+                 drop_lineno: bool = False, cache_size: int = 65536):
+        """把probing返回的帧规范化为火焰图中的帧标签
+
+        同一个 (帧类型, func, file, lineno) 只规范化一次, 结果保存在有界的LRU缓存中,
+        重复出现的帧只需一次字典查找.
+
+        Args:
+            collapse_templates: 是否把C++帧名称中的模板参数折叠为 <...>
+            strip_prefixes: 从文件路径开头去掉的前缀(正则表达式), 如构建目录
+                /usr/local/src/conda/python-[0-9.]+/
+            drop_lineno: 是否去掉行号, 使同一函数的不同行合并为一个帧
+            cache_size: LRU缓存的最大条目数
+        """
+        self.collapse_templates = collapse_templates
+        self.strip_prefixes = list(strip_prefixes)
+        self.drop_lineno = drop_lineno
+        self.cache_size = cache_size
+        self._prefix_re = re.compile("|".join(f"(?:{prefix})" for prefix in self.strip_prefixes)) \
+            if self.strip_prefixes else None
+        self._cached = lru_cache(maxsize=cache_size)(self._normalize)
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> Optional["FrameNormalizer"]:
+        """根据config.json中的normalize段创建, 未配置时返回None"""
+        options = config.get("normalize")
+        if not options:
+            return None
+        return cls(**options)
+
+    def label(self, kind: str, frame: Dict[str, Any]) -> str:
+        """帧的标签
+
+        Args:
+            kind: "CFrame" 或 "PyFrame"
+            frame: 帧字典, 包含func/file/lineno
+
+        Returns:
+            规范化后的 func (file:lineno) 标签
+        """
+        return self._cached(kind, frame['func'], frame['file'], frame['lineno'])
+
+    def _normalize(self, kind: str, func: str, file: str, lineno) -> str:
+        # Python的 <module>/<lambda> 等名称不是模板参数, 只折叠C帧
+        if self.collapse_templates and kind == "CFrame":
+            func = collapse_template_args(func)
+        if self._prefix_re is not None:
+            match = self._prefix_re.match(file)
+            if match:
+                file = file[match.end():]
+        if self.drop_lineno:
+            return f"{func} ({file})"
+        return f"{func} ({file}:{lineno})"
+
+    def cache_info(self):
+        """LRU缓存的命中统计"""
+        return self._cached.cache_info()
+
+    def __getstate__(self):
+        # 传给合并进程时不携带缓存
+        state = self.__dict__.copy()
+        del state["_cached"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._cached = lru_cache(maxsize=self.cache_size)(self._normalize)
@@ -1,6 +1,9 @@
 import json
 import logging
+import multiprocessing
 import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 
 import os
 import sys
@@ -9,26 +12,110 @@ project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 target_subdir = 'debug'
 target_dir = os.path.join(project_root, target_subdir)
 
-from tire_stack import merge_stacks
+from tire_stack import merge_signature_maps, merge_stacks, trie_from_groups
+from svg_renderer import FlameGraphRenderer
+from snapshot_format import SnapshotReader, is_snapshot
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 
+def entries_to_stack(entries, normalizer=None) -> str:
+    """将单个rank的帧列表转换为以 ; 分隔、自底向上的堆栈字符串
+    
+    Args:
+        entries: probing返回的CFrame/PyFrame列表(栈顶在前)
+        normalizer: 帧标签规范化器(FrameNormalizer), 为空时使用原始的 func (file:lineno)
+        
+    Returns:
+        堆栈字符串, 无有效帧时返回空字符串
+    """
+    local_stack = []
+    for entry in entries:
+        if 'CFrame' in entry:
+            kind = 'CFrame'
+        elif 'PyFrame' in entry:
+            kind = 'PyFrame'
+        else:
+            continue
+        frame = entry[kind]
+        if normalizer is not None:
+            local_stack.append(normalizer.label(kind, frame))
+        else:
+            local_stack.append(f"{frame['func']} ({frame['file']}:{frame['lineno']})")
+
+    # 翻转堆栈顺序
+    local_stack.reverse()
+    return "".join(f"{frame};" for frame in local_stack)
+
+
+# fork启动的工作进程直接继承父进程中的堆栈数据, 只需向其传递分片的rank范围
+_SHARED_STACK_DATA = None
+
+
+def group_rank_range(start, end, shard=None, normalizer=None):
+    """把一段连续rank的帧列表转换为堆栈并分组
+
+    Args:
+        start: 分片的第一个rank
+        end: 分片结束的rank(不含)
+        shard: 该分片的帧列表, 为空时从fork继承的_SHARED_STACK_DATA中读取
+        normalizer: 帧标签规范化器
+
+    Returns:
+        (堆栈 -> 全局rank位图, 采集失败的rank位图), 分组按首次出现的rank排列
+    """
+    if shard is None:
+        shard = _SHARED_STACK_DATA[start:end]
+    groups = {}
+    failed = 0
+    for rank, entries in enumerate(shard):
+        bit = 1 << rank
+        if isinstance(entries, dict):
+            failed |= bit
+            stack = ""
+        else:
+            stack = entries_to_stack(entries, normalizer)
+        groups[stack] = groups.get(stack, 0) | bit
+    # 分片内先用局部位图, 最后整体左移, 避免每个rank都复制一次长位图
+    return {stack: mask << start for stack, mask in groups.items()}, failed << start
+
 
 class FlameGraphGenerator:
-    def __init__(self, flamegraph_bin: str = "/home/yang/Downloads/FlameGraph-1.0/flamegraph.pl"
+    def __init__(self, flamegraph_bin: str = None
                  ,input_json:str = "output.json"
-                 ,output_file: str = "stacks.txt"):
+                 ,output_file: str = "stacks.txt"
+                 ,title: str = "Cluster stack information"
+                 ,merge_workers: int = 1
+                 ,normalizer=None
+                 ,metrics=None):
         """初始化火焰图生成器
         
         Args:
-            flamegraph_bin: FlameGraph工具的路径
+            flamegraph_bin: FlameGraph工具的路径, 为空时使用内置的SVG渲染器
+            input_json: 离线模式下读取的堆栈数据文件, JSON或二进制快照
+            output_file: 折叠格式堆栈文件(仅flamegraph.pl需要)
+            title: 火焰图标题
+            merge_workers: 合并堆栈时使用的进程数, 为1时在当前进程中合并
+            normalizer: 帧标签规范化器(FrameNormalizer), 为空时不做规范化
+            metrics: 记录各阶段耗时的PipelineMetrics, 为空时不记录
         """
         self.flamegraph_bin = flamegraph_bin
         self.input_json = input_json
         self.output_file = output_file
+        self.title = title
+        self.merge_workers = merge_workers
+        self.normalizer = normalizer
+        self.metrics = metrics
+
+    def _stage(self, name: str):
+        return self.metrics.stage(name) if self.metrics is not None else nullcontext()
+
+    def _record_output(self, kind: str, path: str) -> None:
+        """记录输出文件的字节数"""
+        if self.metrics is not None:
+            self.metrics.add_bytes(kind, os.path.getsize(path))
         
     def convert_to_flamegraph_format(self):
         """将堆栈数据转换为FlameGraph工具接受的格式
@@ -43,61 +130,143 @@ class FlameGraphGenerator:
         with open(self.input_json, 'r') as f:
             data = json.load(f)
         
-        # 解析调用栈
-        out_stacks = [[]]
-        for rank in data:
-            local_stack = []
-            for entry in rank:
-                stack = []
-                if 'CFrame' in entry:
-                    frame = entry['CFrame']
-                    stack.append(f"{frame['func']} ({frame['file']}:{frame['lineno']})")
-                elif 'PyFrame' in entry:
-                    frame = entry['PyFrame']
-                    stack.append(f"{frame['func']} ({frame['file']}:{frame['lineno']})")
-                
-                # 将调用栈路径添加到列表中
-                if stack:
-                    local_stack.append(';'.join(stack))  # 当前rank的堆栈
-            out_stacks.append(local_stack)  # 将当前rank的堆栈添加到总堆栈列表中
+        self.write_folded(self.merge_stack_data(data, workers=self.merge_workers, normalizer=self.normalizer))
+
+    def load_trie(self):
+        """读取input_json并合并为StackTrie, 二进制快照通过mmap按需读取"""
+        if is_snapshot(self.input_json):
+            with SnapshotReader(self.input_json) as reader:
+                return merge_stacks(reader, reader.failed_ranks())
+        with open(self.input_json, 'r') as f:
+            return self.merge_stack_data(json.load(f), workers=self.merge_workers,
+                                         normalizer=self.normalizer)
+
+    @staticmethod
+    def stack_data_to_rank_stacks(stack_data, normalizer=None):
+        """把各rank的帧列表转换为与rank一一对应的堆栈字符串列表
+        
+        采集失败或没有堆栈的rank保留为空字符串, 不会让后面的rank错位.
+        
+        Args:
+            stack_data: 各rank的帧列表, 采集失败的rank为带error字段的字典
+            normalizer: 帧标签规范化器
             
+        Returns:
+            下标为rank的堆栈字符串列表, 采集失败的rank为空字符串
+        """
+        return ["" if isinstance(entries, dict) else entries_to_stack(entries, normalizer)
+                for entries in stack_data]
+
+    @staticmethod
+    def failed_ranks(stack_data):
+        """采集失败(超时或出错)的rank列表"""
+        return [rank for rank, entries in enumerate(stack_data) if isinstance(entries, dict)]
+
+    @staticmethod
+    def group_stack_data(stack_data, workers: int = 1, shards_per_worker: int = 4, normalizer=None):
+        """把各rank的帧列表转换为堆栈并按堆栈分组, 可按rank分片在多个进程中并行
         
-        # 翻转堆栈顺序
-        for stack in out_stacks:
-            stack.reverse()  # 直接修改原列表
+        每个分片只返回 不同堆栈 -> rank位图, 按rank顺序合并后与串行分组的结果(含顺序)完全一致.
         
-        # 将堆栈数据写入输出文件
-        prepare_stacks = []
-        for rank in out_stacks:
-            if rank != []:
-                data = ""
-                for stack in rank:
-                        data += f"{stack};"
-                prepare_stacks.append(data)
+        Args:
+            stack_data: 各rank的帧列表, 采集失败的rank为带error字段的字典
+            workers: 进程数, 为1时在当前进程中分组
+            shards_per_worker: 每个进程分到的分片数, 分片越多负载越均衡
+            normalizer: 帧标签规范化器, 每个进程各自维护缓存
+            
+        Returns:
+            (堆栈 -> rank位图, 采集失败的rank位图)
+        """
+        global _SHARED_STACK_DATA
+        num_ranks = len(stack_data)
+        if workers <= 1 or num_ranks < 2 * workers:
+            return group_rank_range(0, num_ranks, stack_data, normalizer)
+
+        num_shards = min(num_ranks, workers * shards_per_worker)
+        bounds = [num_ranks * i // num_shards for i in range(num_shards + 1)]
+        ranges = list(zip(bounds, bounds[1:]))
+        use_fork = "fork" in multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("fork" if use_fork else None)
+        try:
+            if use_fork:
+                _SHARED_STACK_DATA = stack_data
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+                futures = [pool.submit(group_rank_range, start, end,
+                                       None if use_fork else stack_data[start:end], normalizer)
+                           for start, end in ranges]
+                results = [future.result() for future in futures]
+        finally:
+            _SHARED_STACK_DATA = None
+
+        failed = 0
+        for _, shard_failed in results:
+            failed |= shard_failed
+        return merge_signature_maps(groups for groups, _ in results), failed
+
+    @staticmethod
+    def merge_stack_data(stack_data, workers: int = 1, normalizer=None):
+        """解析各rank的帧列表并合并为StackTrie
         
+        Args:
+            stack_data: 各rank的帧列表, 可直接来自StackCollector
+            workers: 解析与分组使用的进程数, 结果与串行合并完全一致
+            normalizer: 帧标签规范化器
+            
+        Returns:
+            合并后的StackTrie, 采集失败的rank标注在rank标注的第三段
+        """
         # 合并堆栈
-        trie = merge_stacks(prepare_stacks)
+        groups, failed = FlameGraphGenerator.group_stack_data(stack_data, workers=workers, normalizer=normalizer)
+        return trie_from_groups(groups, len(stack_data), failed)
+
+    def write_folded(self, trie, weighted: bool = False) -> None:
+        """将合并后的堆栈写入折叠格式文件
+        
+        Args:
+            trie: 合并后的StackTrie
+            weighted: 为True时写入每条堆栈的采样次数, 否则每条堆栈计为1
+        """
         with open(self.output_file, "w") as f:
-            for stack in trie:
-                f.write(f"{stack}; 1\n")
+            trie.dump(f, weighted=weighted)
+        self._record_output("folded", self.output_file)
     
-    def generate_flamegraph(self, output_file: str) -> None:
+    def generate_flamegraph(self, output_file: str, trie=None, weighted: bool = False) -> None:
         """生成火焰图
         
         Args:
-            stack_data: 堆栈数据列表
             output_file: 输出SVG文件名
+            trie: 已合并的StackTrie, 为空时从input_json读取
+            weighted: 是否按采样次数绘制(采样模式), 为True时同时写出带采样次数的折叠文件
         """
+        if trie is None:
+            with self._stage("merge"):
+                trie = self.load_trie()
+
+        if not self.flamegraph_bin:
+            # 内置渲染器直接布局内存中的trie, 边遍历边写出SVG
+            if weighted:
+                # 采样次数只保存在折叠文件中, 供后续分析与对比
+                with self._stage("write_folded"):
+                    self.write_folded(trie, weighted=True)
+            with self._stage("render"), open(output_file, 'w') as out:
+                FlameGraphRenderer(title=self.title).render(trie, out, weighted=weighted)
+            self._record_output("svg", output_file)
+            logger.info(f"火焰图已生成: {output_file}")
+            return
+
         # 转换数据格式
-        flamegraph_input = self.convert_to_flamegraph_format()
+        with self._stage("write_folded"):
+            self.write_folded(trie, weighted=weighted)
              
         try:
             # 调用FlameGraph工具生成SVG
-            cmd = [self.flamegraph_bin, "--title=Cluster stack information", "--colors=java", "--hash", self.output_file]
+            cmd = [self.flamegraph_bin, f"--title={self.title}", "--colors=java", "--hash", self.output_file]
             logger.info(f"执行命令: {' '.join(cmd)}")
-            result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+            with self._stage("flamegraph_pl"):
+                result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
             with open(output_file, 'w') as out:
                 out.write(result.stdout.decode('utf-8'))
+            self._record_output("svg", output_file)
             logger.info(f"火焰图已生成: {output_file}")
         except subprocess.CalledProcessError as e:
             logger.error(f"生成火焰图失败: {e.stderr.decode('utf-8')}")
@@ -2,50 +2,219 @@ import argparse
 import json
 import logging
 import sys
+import time
+from contextlib import nullcontext
 
 sys.path.append(".")
 from collect_stack_info import StackCollector
+from frame_normalizer import FrameNormalizer
 from framegraph_generator import FlameGraphGenerator
+from metrics import PipelineMetrics, profiled
+from sampler import StackSampler
+from snapshot_diff import SnapshotDiffer
+from snapshot_format import write_snapshot
+from snapshot_store import SnapshotStore
+from tire_stack import (format_rank_ranges, format_signature_table, mask_to_ranks, merge_partials,
+                        parse_rank_ranges, ranks_to_mask, trie_from_groups)
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+def watch(collector, generator, endpoints, max_workers, interval, stuck_threshold, metrics, metrics_file=None,
+          store=None):
+    """持续快照, 每次只把发生变化的rank增量更新到trie, 并输出差异报告, 给定store时同时追加到快照库"""
+    differ = SnapshotDiffer(len(endpoints), stuck_threshold=stuck_threshold)
+    try:
+        while True:
+            started = time.monotonic()
+            timestamp = time.time()
+            with metrics.stage("collect"):
+                stack_data = collector.collect_from_multiple_endpoints(endpoints, max_workers=max_workers)
+            metrics.record_collection(collector.endpoint_stats)
+            with metrics.stage("merge"):
+                stacks = generator.stack_data_to_rank_stacks(stack_data, generator.normalizer)
+                diff = differ.update(stacks)
+                differ.trie.set_failed_ranks(ranks_to_mask(generator.failed_ranks(stack_data)))
+            if store is not None:
+                with metrics.stage("store"):
+                    store.append(stacks, timestamp)
+            with open("./snapshot_diff.txt", "a") as f:
+                f.write("\n".join(diff.format_report()) + "\n")
+            if diff.changed_stacks:
+                with open("./snapshot_diff.folded", "w") as f:
+                    f.write("\n".join(diff.format_folded()) + "\n")
+                metrics.record_trie(differ.trie)
+                generator.generate_flamegraph("./debug_flamegraph_4ranks.svg", trie=differ.trie)
+            logger.info(f"快照 {diff.snapshot}: {len(diff.moved)} 个rank变化, "
+                        f"{bin(diff.stuck_ranks).count('1')} 个rank卡住")
+            # 持续运行时每轮刷新指标文件, 便于node_exporter等定期读取
+            if metrics_file:
+                metrics.save(metrics_file)
+            time.sleep(max(0.0, started + interval - time.monotonic()))
+    except KeyboardInterrupt:
+        logger.info("停止监控")
+
+def aggregator_layout(config):
+    """解析配置中的聚合代理及各自负责的rank
+
+    aggregators 的每一项可以是URL, 也可以是 {"url": URL, "ranks": "0-7"};
+    集群的全部rank取各项ranks的并集, 都未配置时取 num_ranks.
+
+    Returns:
+        (聚合代理URL列表, 各代理负责的rank位图(未配置时为None), 集群的全部rank(无法确定时为None))
+    """
+    urls, masks = [], []
+    for aggregator in config.get("aggregators", []):
+        if isinstance(aggregator, str):
+            urls.append(aggregator)
+            masks.append(None)
+        else:
+            urls.append(aggregator["url"])
+            masks.append(parse_rank_ranges(aggregator["ranks"]) if "ranks" in aggregator else None)
+    if any(mask is not None for mask in masks):
+        all_mask = 0
+        for mask in masks:
+            all_mask |= mask or 0
+        return urls, masks, mask_to_ranks(all_mask)
+    if "num_ranks" in config:
+        return urls, masks, list(range(config["num_ranks"]))
+    return urls, masks, None
+
+def run(args, config, metrics):
+    """按配置与命令行参数执行一次采集任务"""
+    endpoints = config.get("endpoints", [])
+    aggregators = config.get("aggregators", [])
+    if not endpoints and not aggregators:
+        logger.error("配置文件中未找到端点列表")
+        return
+    if args.store and aggregators:
+        logger.warning("分层采集模式下不保存到快照库, 忽略 --store")
+    store = SnapshotStore(args.store, num_ranks=len(endpoints)) if args.store and not aggregators else None
+    try:
+        collect(args, config, metrics, endpoints, aggregators, store)
+    finally:
+        if store is not None:
+            store.close()
+
+def collect(args, config, metrics, endpoints, aggregators, store):
+    """采集并生成火焰图, 各模式的具体流程"""
+    # 收集数据
+    collector = StackCollector.from_config(config, keep_locals=args.keep_locals)
+    max_workers = config.get("max_workers", 64)
+    # 未配置flamegraph_bin时使用内置的SVG渲染器
+    flamegraph_bin = config.get("flamegraph_bin")
+    merge_workers = args.merge_workers or config.get("merge_workers", 1)
+    generator = FlameGraphGenerator(output_file="./debug_4stacks.txt",
+                                    flamegraph_bin=flamegraph_bin,
+                                    merge_workers=merge_workers,
+                                    normalizer=FrameNormalizer.from_config(config),
+                                    metrics=metrics)
+
+    if aggregators:
+        # 分层采集: 各节点的聚合代理预合并本节点的rank, 这里只合并各节点的结果
+        urls, masks, all_ranks = aggregator_layout(config)
+        if all_ranks is None:
+            logger.warning("配置中没有num_ranks或各聚合代理的ranks, 不可达的聚合代理负责的rank无法标注为未采集到")
+        with metrics.stage("collect"):
+            partials = collector.collect_partials(urls, max_workers=max_workers)
+        metrics.record_collection(collector.endpoint_stats)
+        for url, mask, partial in zip(urls, masks, partials):
+            if "error" in partial:
+                ranks = f", rank @{format_rank_ranges(mask)} 记为未采集到" if mask else ""
+                logger.warning(f"聚合代理 {url} 采集失败{ranks}: {partial['error']}")
+        with metrics.stage("merge"):
+            trie = merge_partials([partial for partial in partials if "error" not in partial], all_ranks)
+        metrics.record_trie(trie)
+        generator.generate_flamegraph("./debug_flamegraph_4ranks.svg", trie=trie)
+    elif args.watch > 0:
+        watch(collector, generator, endpoints, max_workers, args.watch, args.stuck_threshold,
+              metrics, args.metrics_file, store)
+    elif args.duration > 0:
+        # 连续采样, 按相同堆栈聚合出带权重的火焰图
+        sampler = StackSampler(collector, endpoints, max_workers=max_workers,
+                               normalizer=generator.normalizer, metrics=metrics, store=store)
+        trie = sampler.run(args.duration, args.interval)
+        metrics.record_trie(trie)
+        generator.generate_flamegraph("./debug_flamegraph_4ranks.svg", trie=trie, weighted=True)
+    else:
+        timestamp = time.time()
+        with metrics.stage("collect"):
+            stack_data = collector.collect_from_multiple_endpoints(
+                endpoints, 
+                max_workers=max_workers
+            )
+        metrics.record_collection(collector.endpoint_stats)
+        if args.save_json:
+            collector.save_to_json(stack_data, args.save_json)
+        if args.save_status:
+            collector.save_status(args.save_status)
+        if args.save_snapshot or store is not None:
+            rank_stacks = generator.stack_data_to_rank_stacks(stack_data, generator.normalizer)
+        if args.save_snapshot:
+            write_snapshot(args.save_snapshot, rank_stacks, generator.failed_ranks(stack_data))
+            logger.info(f"快照已保存到 {args.save_snapshot}")
+        if store is not None:
+            with metrics.stage("store"):
+                store.append(rank_stacks, timestamp)
+            logger.info(f"快照已追加到快照库 {args.store}, 共 {len(store)} 个样本")
+        
+        # 生成火焰图, 采集结果直接在内存中合并, 相同的堆栈只插入一次
+        # 超时或出错的rank仍占据自己的rank号, 到期时用已返回的rank画出部分火焰图
+        with metrics.stage("merge"):
+            groups, failed = generator.group_stack_data(stack_data, workers=merge_workers,
+                                                        normalizer=generator.normalizer)
+            trie = trie_from_groups(groups, len(stack_data), failed)
+        if failed:
+            logger.warning(f"{bin(failed).count('1')}/{len(endpoints)} 个rank未采集到堆栈, 火焰图只包含其余rank")
+        metrics.record_trie(trie)
+        if args.signatures:
+            table = format_signature_table(groups)
+            with open(args.signatures, "w") as f:
+                f.write("\n".join(table) + "\n")
+            logger.info(f"共 {len(table) - 1} 种不同的堆栈, 汇总表已保存到 {args.signatures}")
+        generator.generate_flamegraph("./debug_flamegraph_4ranks.svg", trie=trie)
+    
+    logger.info("任务完成")
+
 def main():
     parser = argparse.ArgumentParser(description="分布式堆栈信息收集与火焰图生成工具")
     parser.add_argument("--config", default="../config/config.json", help="配置文件路径")
     parser.add_argument("--output", default="flamegraph.svg", help="输出火焰图文件名")
+    parser.add_argument("--duration", type=float, default=0, help="连续采样时长(秒), 为0时只采集一次快照")
+    parser.add_argument("--interval", type=float, default=1.0, help="连续采样的间隔(秒)")
+    parser.add_argument("--save-json", default=None, help="将采集到的原始堆栈另存为JSON文件")
+    parser.add_argument("--keep-locals", action="store_true", help="保留PyFrame中的locals")
+    parser.add_argument("--save-status", default=None, help="将各rank的采集状态(ok/timeout/error)与延迟保存为JSON文件")
+    parser.add_argument("--save-snapshot", default=None, help="将本次快照保存为二进制格式(.stk)")
+    parser.add_argument("--store", default=None,
+                        help="把每次快照追加到该目录下的快照时序库, 可用 snapshot_store.py 按时间查询")
+    parser.add_argument("--signatures", default=None, help="输出 堆栈签名 -> rank范围 汇总表的文件")
+    parser.add_argument("--watch", type=float, default=0, help="按该间隔(秒)持续快照, 只增量更新发生变化的rank")
+    parser.add_argument("--merge-workers", type=int, default=None,
+                        help="解析与合并堆栈使用的进程数, 默认读取配置中的merge_workers(未配置时为1)")
+    parser.add_argument("--stuck-threshold", type=int, default=3, help="堆栈连续多少次快照未变化时认为rank卡住")
+    parser.add_argument("--metrics-file", default=None,
+                        help="保存各阶段耗时、字节数(响应、SVG与折叠格式输出)、各端点的延迟直方图与trie规模, "
+                             "以 .prom 结尾时为Prometheus文本格式")
+    parser.add_argument("--profile", default=None, help="用cProfile与tracemalloc剖析本次运行, 结果写入该前缀的文件")
     args = parser.parse_args()
     
     try:
         # 读取配置文件
         with open(args.config, 'r') as f:
             config = json.load(f)
-            
-        endpoints = config.get("endpoints", [])
-        if not endpoints:
-            logger.error("配置文件中未找到端点列表")
-            return
-            
-        # 收集数据
-        collector = StackCollector(timeout=config.get("timeout", 10))
-        stack_data = collector.collect_from_multiple_endpoints(
-            endpoints, 
-            max_workers=config.get("max_workers", 5)
-        )
-        collector.save_to_json(stack_data, "debug_4ranks_stack_data.json")    
-        
-        # 生成火焰图
-        flamegraph_bin = config.get("flamegraph_bin", "flamegraph.pl")
-        generator = FlameGraphGenerator(input_json="./debug_4ranks_stack_data.json", 
-                                        output_file="./debug_4stacks.txt",
-                                        flamegraph_bin=flamegraph_bin)
-        generator.generate_flamegraph("./debug_flamegraph_4ranks.svg")
-        
-        logger.info("任务完成")
+
+        metrics = PipelineMetrics()
+        try:
+            with profiled(args.profile) if args.profile else nullcontext():
+                run(args, config, metrics)
+        finally:
+            if args.metrics_file:
+                metrics.save(args.metrics_file)
         
     except Exception as e:
         logger.error(f"执行过程中发生错误: {str(e)}", exc_info=True)
 
 if __name__ == "__main__":
-    main()    
\ No newline at end of file
+    main()
@@ -0,0 +1,201 @@
+import cProfile
+import io
+import json
+import logging
+import pstats
+import threading
+import time
+import tracemalloc
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Dict, List
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# 端点延迟直方图的桶上界(秒)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+_PREFIX = "stackdraw"
+
+
+def _label(value: str) -> str:
+    """转义Prometheus标签值"""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class PipelineMetrics:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """采集流水线的运行指标: 各阶段耗时、字节数、各端点的延迟直方图与trie规模
+
+        可以多次采集累加(如连续采样或常驻服务), 各方法线程安全.
+
+        Args:
+            buckets: 端点延迟直方图的桶上界(秒), 升序
+        """
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self.stages: Dict[str, Dict[str, float]] = {}      # 阶段 -> {runs, seconds, last}
+        self.bytes: Dict[str, int] = {}                     # 类别 -> 字节数
+        self.bucket_counts = [0] * (len(self.buckets) + 1)  # 最后一个为 +Inf
+        self.latency_sum = 0.0
+        self.latency_count = 0
+        self.endpoint_latency: Dict[str, Dict[str, Any]] = {}  # 端点 -> {counts, sum, count}
+        self.endpoint_status: Dict[str, int] = {}           # 最近一次采集各状态的端点数
+        self.attempts = 0
+        self.trie: Dict[str, int] = {}
+        self.started_at = time.time()
+
+    @contextmanager
+    def stage(self, name: str):
+        """记录一个阶段的耗时, 同名阶段累加"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                stage = self.stages.setdefault(name, {"runs": 0, "seconds": 0.0, "last": 0.0})
+                stage["runs"] += 1
+                stage["seconds"] += elapsed
+                stage["last"] = elapsed
+
+    def add_bytes(self, kind: str, count: int) -> None:
+        with self._lock:
+            self.bytes[kind] = self.bytes.get(kind, 0) + count
+
+    def record_collection(self, endpoint_stats: List[Dict[str, Any]]) -> None:
+        """记录一次采集中各端点的状态、延迟与响应字节数
+
+        Args:
+            endpoint_stats: StackCollector.endpoint_stats
+        """
+        statuses: Dict[str, int] = {}
+        received = 0
+        with self._lock:
+            for stat in endpoint_stats:
+                statuses[stat["status"]] = statuses.get(stat["status"], 0) + 1
+                received += stat.get("bytes", 0)
+                self.attempts += stat.get("attempts", 0)
+                if stat["latency"] is None:
+                    continue
+                bucket = bisect_left(self.buckets, stat["latency"])
+                self.bucket_counts[bucket] += 1
+                self.latency_sum += stat["latency"]
+                self.latency_count += 1
+                histogram = self.endpoint_latency.get(stat["endpoint"])
+                if histogram is None:
+                    histogram = self.endpoint_latency[stat["endpoint"]] = {
+                        "counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+                histogram["counts"][bucket] += 1
+                histogram["sum"] += stat["latency"]
+                histogram["count"] += 1
+            self.endpoint_status = statuses
+            self.bytes["response"] = self.bytes.get("response", 0) + received
+
+    def record_trie(self, trie) -> None:
+        """记录合并后trie的规模"""
+        stats = trie.stats()
+        with self._lock:
+            self.trie = stats
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "uptime_seconds": time.time() - self.started_at,
+                "stages": {name: dict(stage) for name, stage in self.stages.items()},
+                "bytes": dict(self.bytes),
+                "endpoint_latency": {
+                    "buckets": list(self.buckets),
+                    "counts": list(self.bucket_counts),
+                    "sum": self.latency_sum,
+                    "count": self.latency_count,
+                },
+                "endpoint_latency_by_endpoint": {
+                    endpoint: {"counts": list(histogram["counts"]), "sum": histogram["sum"],
+                               "count": histogram["count"]}
+                    for endpoint, histogram in self.endpoint_latency.items()
+                },
+                "endpoint_status": dict(self.endpoint_status),
+                "attempts": self.attempts,
+                "trie": dict(self.trie),
+            }
+
+    def to_prometheus(self) -> str:
+        """Prometheus文本格式"""
+        data = self.to_dict()
+        lines = [f"# TYPE {_PREFIX}_stage_seconds_total counter"]
+        for name, stage in data["stages"].items():
+            lines.append(f'{_PREFIX}_stage_seconds_total{{stage="{name}"}} {stage["seconds"]:.6f}')
+        lines.append(f"# TYPE {_PREFIX}_stage_runs_total counter")
+        for name, stage in data["stages"].items():
+            lines.append(f'{_PREFIX}_stage_runs_total{{stage="{name}"}} {stage["runs"]}')
+        lines.append(f"# TYPE {_PREFIX}_stage_last_seconds gauge")
+        for name, stage in data["stages"].items():
+            lines.append(f'{_PREFIX}_stage_last_seconds{{stage="{name}"}} {stage["last"]:.6f}')
+        lines.append(f"# TYPE {_PREFIX}_bytes_total counter")
+        for kind, count in data["bytes"].items():
+            lines.append(f'{_PREFIX}_bytes_total{{kind="{kind}"}} {count}')
+
+        # 每个端点一组直方图, 全局分布可用 sum by (le) 聚合得到
+        bounds = list(data["endpoint_latency"]["buckets"]) + ["+Inf"]
+        lines.append(f"# TYPE {_PREFIX}_endpoint_latency_seconds histogram")
+        for endpoint, latency in data["endpoint_latency_by_endpoint"].items():
+            label = f'endpoint="{_label(endpoint)}"'
+            cumulative = 0
+            for bound, count in zip(bounds, latency["counts"]):
+                cumulative += count
+                lines.append(f'{_PREFIX}_endpoint_latency_seconds_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f"{_PREFIX}_endpoint_latency_seconds_sum{{{label}}} {latency['sum']:.6f}")
+            lines.append(f"{_PREFIX}_endpoint_latency_seconds_count{{{label}}} {latency['count']}")
+
+        lines.append(f"# TYPE {_PREFIX}_endpoints gauge")
+        for status, count in data["endpoint_status"].items():
+            lines.append(f'{_PREFIX}_endpoints{{status="{status}"}} {count}')
+        lines.append(f"# TYPE {_PREFIX}_request_attempts_total counter")
+        lines.append(f"{_PREFIX}_request_attempts_total {data['attempts']}")
+        for key, value in data["trie"].items():
+            lines.append(f"# TYPE {_PREFIX}_trie_{key} gauge")
+            lines.append(f"{_PREFIX}_trie_{key} {value}")
+        return "\n".join(lines) + "\n"
+
+    def save(self, filename: str) -> None:
+        """保存指标, 文件名以 .prom 结尾时写Prometheus文本格式(可供node_exporter的textfile收集), 否则写JSON"""
+        with open(filename, "w") as f:
+            if filename.endswith(".prom"):
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.to_dict(), f, indent=4)
+        logger.info(f"运行指标已保存到 {filename}")
+
+
+@contextmanager
+def profiled(prefix: str, top: int = 20):
+    """用cProfile与tracemalloc剖析一段代码
+
+    结束后写出 <prefix>.pstats(可用snakeviz等工具查看), 并在日志中输出累计耗时最高的函数与内存分配最多的位置.
+
+    Args:
+        prefix: 输出文件名前缀
+        top: 日志中输出的条目数
+    """
+    tracemalloc.start()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        profiler.dump_stats(f"{prefix}.pstats")
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(top)
+        allocations = "\n".join(str(stat) for stat in snapshot.statistics("lineno")[:top])
+        with open(f"{prefix}.txt", "w") as f:
+            f.write(out.getvalue())
+            f.write(f"\n# tracemalloc: 当前 {current / 2 ** 20:.1f} MiB, 峰值 {peak / 2 ** 20:.1f} MiB\n")
+            f.write(allocations + "\n")
+        logger.info(f"剖析结果已保存到 {prefix}.pstats 与 {prefix}.txt, 内存峰值 {peak / 2 ** 20:.1f} MiB")
@@ -0,0 +1,82 @@
+import logging
+import time
+from contextlib import nullcontext
+from typing import List
+
+import sys
+sys.path.append(".")
+from collect_stack_info import StackCollector
+from framegraph_generator import FlameGraphGenerator
+from tire_stack import StackTrie, group_stacks
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+class StackSampler:
+    def __init__(self, collector: StackCollector, endpoints: List[str], max_workers: int = 64,
+                 normalizer=None, metrics=None, store=None):
+        """初始化连续采样器
+
+        Args:
+            collector: 用于采集单次快照的堆栈收集器
+            endpoints: 端点URL列表, 列表下标即rank编号
+            max_workers: 全局最大并发请求数
+            normalizer: 帧标签规范化器, 缓存在各轮采样之间复用
+            metrics: 记录各轮采集与合并耗时的PipelineMetrics, 为空时不记录
+            store: 追加每轮样本的SnapshotStore, 为空时不保存
+        """
+        self.collector = collector
+        self.endpoints = endpoints
+        self.max_workers = max_workers
+        self.normalizer = normalizer
+        self.metrics = metrics
+        self.store = store
+        self.trie = StackTrie(set(range(len(endpoints))))
+        self.samples = 0
+
+    def _stage(self, name: str):
+        return self.metrics.stage(name) if self.metrics is not None else nullcontext()
+
+    def sample_once(self) -> None:
+        """采集一次所有端点的堆栈, 并把相同堆栈累加到trie的计数中"""
+        timestamp = time.time()
+        with self._stage("collect"):
+            stack_data = self.collector.collect_from_multiple_endpoints(self.endpoints, max_workers=self.max_workers)
+        if self.metrics is not None:
+            self.metrics.record_collection(self.collector.endpoint_stats)
+        with self._stage("merge"):
+            # 采集失败的rank不计入本轮样本
+            stacks = FlameGraphGenerator.stack_data_to_rank_stacks(stack_data, self.normalizer)
+            # 本轮相同的堆栈只插入一次, 采样次数为对应的rank数
+            for stack, mask in group_stacks(stacks).items():
+                if stack:
+                    self.trie.insert_mask(stack.split(";"), mask, count=bin(mask).count("1"))
+        if self.store is not None:
+            with self._stage("store"):
+                self.store.append(stacks, timestamp)
+        self.samples += 1
+
+    def run(self, duration: float, interval: float) -> StackTrie:
+        """在duration秒内按interval间隔持续采样
+
+        内存只随不同堆栈的数量增长, 与采样次数无关.
+
+        Args:
+            duration: 采样总时长(秒)
+            interval: 两次采样开始之间的间隔(秒)
+
+        Returns:
+            聚合了所有样本的StackTrie
+        """
+        deadline = time.monotonic() + duration
+        while True:
+            started = time.monotonic()
+            self.sample_once()
+            next_start = started + interval
+            if next_start >= deadline:
+                break
+            time.sleep(max(0.0, next_start - time.monotonic()))
+        logger.info(f"采样结束: 共 {self.samples} 轮, {len(self.endpoints)} 个端点")
+        return self.trie
@@ -0,0 +1,267 @@
+import argparse
+import io
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, urlsplit
+
+import sys
+sys.path.append(".")
+from collect_stack_info import StackCollector
+from frame_normalizer import FrameNormalizer
+from framegraph_generator import FlameGraphGenerator
+from metrics import PipelineMetrics
+from snapshot_diff import SnapshotDiffer
+from svg_renderer import FlameGraphRenderer
+from tire_stack import parse_rank_ranges, ranks_to_mask
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+_CONTENT_TYPES = {
+    "svg": "image/svg+xml; charset=utf-8",
+    "folded": "text/plain; charset=utf-8",
+    "json": "application/json",
+    "prometheus": "text/plain; version=0.0.4; charset=utf-8",
+}
+
+
+class LiveFlameGraph:
+    def __init__(self, collector: StackCollector, endpoints: List[str], max_workers: int = 64,
+                 interval: float = 10.0, title: str = "Cluster stack information", cache_size: int = 64,
+                 normalizer=None):
+        """常驻内存的集群火焰图, 按固定间隔刷新, 所有查看者共享同一次采集
+
+        trie通过SnapshotDiffer原地增量更新; 渲染结果按 (快照版本, 视图) 缓存,
+        只有快照真正变化时版本号才会增加, 旧的缓存随之失效.
+
+        Args:
+            collector: 堆栈收集器
+            endpoints: 端点URL列表, 列表下标即rank编号
+            max_workers: 全局最大并发请求数
+            interval: 两次刷新开始之间的间隔(秒)
+            title: 火焰图标题
+            cache_size: 最多缓存的渲染结果数
+            normalizer: 帧标签规范化器, 缓存在各次刷新之间复用
+        """
+        self.collector = collector
+        self.endpoints = endpoints
+        self.max_workers = max_workers
+        self.interval = interval
+        self.title = title
+        self.cache_size = cache_size
+        self.normalizer = normalizer
+        self.metrics = PipelineMetrics()
+        self.differ = SnapshotDiffer(len(endpoints))
+        self.version = 0
+        # 区分服务的不同启动, 避免重启后版本号重复导致客户端误用旧的ETag
+        self.epoch = f"{int(time.time()):x}"
+        self.refreshed_at: Optional[float] = None
+        self.stacks: List[str] = [""] * len(endpoints)
+        self.rank_status: List[Dict[str, Any]] = []
+        # 刷新与渲染都持有该锁, 渲染时trie不会被修改
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[tuple, bytes]" = OrderedDict()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def refresh(self) -> bool:
+        """采集一次快照并增量更新trie
+
+        Returns:
+            快照是否发生了变化
+        """
+        with self.metrics.stage("collect"):
+            stack_data = self.collector.collect_from_multiple_endpoints(self.endpoints, max_workers=self.max_workers)
+        self.metrics.record_collection(self.collector.endpoint_stats)
+        stacks = FlameGraphGenerator.stack_data_to_rank_stacks(stack_data, self.normalizer)
+        failed_mask = ranks_to_mask(FlameGraphGenerator.failed_ranks(stack_data))
+        with self._lock, self.metrics.stage("merge"):
+            diff = self.differ.update(stacks)
+            changed = bool(diff.moved) or failed_mask != self.differ.trie.failed_mask or self.version == 0
+            self.differ.trie.set_failed_ranks(failed_mask)
+            self.stacks = stacks
+            self.rank_status = [dict(stat) for stat in self.collector.endpoint_stats]
+            self.refreshed_at = time.time()
+            if changed:
+                self.version += 1
+                self._cache.clear()
+                self.metrics.record_trie(self.differ.trie)
+        if changed:
+            logger.info(f"快照已更新到版本 {self.version}: {len(diff.moved)} 个rank变化")
+        return changed
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"刷新快照失败: {str(e)}", exc_info=True)
+            self._stop.wait(max(0.0, started + self.interval - time.monotonic()))
+
+    def start(self) -> "LiveFlameGraph":
+        """在后台线程中按间隔持续刷新"""
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def render(self, kind: str, prefix: tuple = (), ranks: str = "") -> Optional[bytes]:
+        """渲染火焰图(svg)或折叠格式(folded), 结果按快照版本缓存
+
+        Args:
+            kind: "svg" 或 "folded"
+            prefix: 只看以这些帧(自底向上, 不含rank标注)开头的子树
+            ranks: 只看这些rank, 格式同 0-3/5/7-9, 为空时包含所有rank
+
+        Returns:
+            渲染结果, 前缀不存在或没有所选rank时返回None
+        """
+        mask = parse_rank_ranges(ranks, len(self.endpoints)) if ranks else None
+        with self._lock:
+            key = (self.version, kind, prefix, mask)
+            body = self._cache.get(key)
+            if body is not None:
+                self._cache.move_to_end(key)
+                return body
+            trie = self.differ.trie
+            if prefix or mask is not None:
+                # 子树直接从内存中的trie裁剪得到, 无需重新合并
+                trie = trie.subtree(prefix, mask)
+                if trie is None:
+                    return None
+            out = io.StringIO()
+            # 只有缓存未命中时才计入渲染耗时
+            with self.metrics.stage(f"render_{kind}"):
+                if kind == "svg":
+                    FlameGraphRenderer(title=self.title).render(trie, out)
+                else:
+                    trie.dump(out)
+            body = out.getvalue().encode("utf-8")
+            self._cache[key] = body
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return body
+
+    def rank_info(self, rank: int) -> Dict[str, Any]:
+        """单个rank最近一次快照的堆栈(自底向上的帧列表)与采集状态"""
+        with self._lock:
+            stack = self.stacks[rank]
+            info = {"rank": rank, "version": self.version,
+                    "frames": [frame for frame in stack.split(";") if frame]}
+            if rank < len(self.rank_status):
+                info.update(self.rank_status[rank])
+            return info
+
+    def status(self) -> Dict[str, Any]:
+        """快照版本、刷新时间与各状态的rank数"""
+        with self._lock:
+            statuses: Dict[str, int] = {}
+            for stat in self.rank_status:
+                statuses[stat["status"]] = statuses.get(stat["status"], 0) + 1
+            return {"version": self.version, "refreshed_at": self.refreshed_at,
+                    "ranks": len(self.endpoints), "statuses": statuses}
+
+
+def make_handler(live: LiveFlameGraph):
+    class LiveHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            query = parse_qs(url.query)
+            try:
+                if url.path in ("/", "/flamegraph.svg"):
+                    self._send_view("svg", query)
+                elif url.path == "/folded":
+                    self._send_view("folded", query)
+                elif url.path.startswith("/ranks/"):
+                    rank = int(url.path[len("/ranks/"):])
+                    if not 0 <= rank < len(live.endpoints):
+                        self.send_error(404, explain="rank不存在")
+                        return
+                    self._send(json.dumps(live.rank_info(rank)).encode("utf-8"), "json")
+                elif url.path == "/status":
+                    self._send(json.dumps(live.status()).encode("utf-8"), "json")
+                elif url.path == "/metrics":
+                    self._send(live.metrics.to_prometheus().encode("utf-8"), "prometheus")
+                else:
+                    self.send_error(404)
+            except ValueError as e:
+                self.send_error(400, explain=str(e))
+
+        def _send_view(self, kind, query):
+            # 前缀帧以 ; 分隔, 与折叠格式一致
+            prefix = tuple(frame for frame in query.get("prefix", [""])[0].split(";") if frame)
+            ranks = query.get("ranks", [""])[0]
+            version = live.version
+            etag = f'"{live.epoch}-{version}-{kind}-{hash((prefix, ranks)) & 0xffffffff:x}"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            body = live.render(kind, prefix, ranks)
+            if body is None:
+                self.send_error(404, explain="没有匹配的堆栈")
+                return
+            self._send(body, kind, etag if live.version == version else None)
+
+        def _send(self, body, kind, etag=None):
+            self.send_response(200)
+            self.send_header("Content-Type", _CONTENT_TYPES[kind])
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("Cache-Control", "no-cache")
+            if etag:
+                self.send_header("ETag", etag)
+            self.end_headers()
+            self.wfile.write(body)
+            live.metrics.add_bytes("served", len(body))
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    return LiveHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="常驻的集群火焰图服务")
+    parser.add_argument("--config", default="../config/config.json", help="配置文件路径")
+    parser.add_argument("--host", default="0.0.0.0", help="监听地址")
+    parser.add_argument("--port", type=int, default=9931, help="监听端口")
+    parser.add_argument("--interval", type=float, default=10.0, help="刷新快照的间隔(秒)")
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as f:
+        config = json.load(f)
+    endpoints = config.get("endpoints", [])
+    if not endpoints:
+        logger.error("配置文件中未找到端点列表")
+        return
+
+    collector = StackCollector.from_config(config)
+    live = LiveFlameGraph(collector, endpoints, max_workers=config.get("max_workers", 64),
+                          interval=args.interval, normalizer=FrameNormalizer.from_config(config)).start()
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(live))
+    logger.info(f"火焰图服务已启动: http://{args.host}:{args.port}/flamegraph.svg, 每 {args.interval}s 刷新一次")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("停止服务")
+    finally:
+        live.stop()
+
+
+if __name__ == "__main__":
+    main()
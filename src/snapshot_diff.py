@@ -0,0 +1,159 @@
+import logging
+from typing import Dict, List
+
+import sys
+sys.path.append(".")
+from tire_stack import StackTrie, format_rank_ranges, stack_signature
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# 符号表中失效的帧超过一半且总数超过该值时压缩符号表
+COMPACT_MIN_SYMBOLS = 4096
+
+
+class SnapshotDiff:
+    def __init__(self, snapshot: int):
+        """两次连续快照之间的差异
+
+        Args:
+            snapshot: 当前快照的序号
+        """
+        self.snapshot = snapshot
+        self.moved: Dict[int, tuple] = {}       # rank -> (旧签名, 新签名)
+        self.appeared_frames: List[str] = []
+        self.disappeared_frames: List[str] = []
+        self.stuck_ranks = 0                    # 连续多次未变化的rank位图
+        self.changed_stacks: Dict[str, List[int]] = {}  # 堆栈 -> [旧rank数, 新rank数]
+        self.stacks: Dict[str, str] = {}        # 涉及的签名 -> 堆栈字符串
+
+    def format_report(self) -> List[str]:
+        """生成文本报告"""
+        def leaf(signature):
+            if signature is None:
+                return "<无堆栈>"
+            frames = [frame for frame in self.stacks[signature].split(";") if frame]
+            return frames[-1] if frames else "<无堆栈>"
+
+        lines = [f"# 快照 {self.snapshot}: {len(self.moved)} 个rank的堆栈发生变化"]
+        transitions: Dict[tuple, int] = {}
+        for rank, transition in self.moved.items():
+            transitions[transition] = transitions.get(transition, 0) | (1 << rank)
+        for (old, new), mask in transitions.items():
+            lines.append(f"moved  @{format_rank_ranges(mask)}: {leaf(old)} -> {leaf(new)}")
+        for frame in self.appeared_frames:
+            lines.append(f"+ {frame}")
+        for frame in self.disappeared_frames:
+            lines.append(f"- {frame}")
+        if self.stuck_ranks:
+            lines.append(f"stuck  @{format_rank_ranges(self.stuck_ranks)}")
+        return lines
+
+    def format_folded(self) -> List[str]:
+        """发生变化的堆栈, 格式为 堆栈 旧rank数 新rank数 (flamegraph.pl差分火焰图的输入格式)"""
+        return [f"{stack.rstrip(';')} {old} {new}" for stack, (old, new) in self.changed_stacks.items()]
+
+
+class SnapshotDiffer:
+    def __init__(self, num_ranks: int, stuck_threshold: int = 3):
+        """增量对比连续的集群快照, 并原地更新合并后的trie
+
+        只保留每个rank上一次快照的堆栈签名, 每次更新的开销与变化的rank数成正比.
+
+        Args:
+            num_ranks: rank总数
+            stuck_threshold: 堆栈连续多少次快照未变化时认为该rank卡住
+        """
+        self.trie = StackTrie(set(range(num_ranks)))
+        self.stuck_threshold = stuck_threshold
+        self.signatures: List = [None] * num_ranks
+        self.unchanged = [0] * num_ranks
+        self.stacks_by_signature: Dict[str, str] = {}
+        self.signature_ranks: Dict[str, int] = {}   # 签名 -> 当前拥有该堆栈的rank数
+        self.frame_refs: Dict[str, int] = {}        # 帧 -> 当前包含该帧的rank数
+        self.snapshots = 0
+
+    def update(self, stacks: List[str]) -> SnapshotDiff:
+        """用新快照更新trie并返回与上一次快照的差异
+
+        Args:
+            stacks: 下标为rank的堆栈字符串, 采集失败的rank为空字符串
+
+        Returns:
+            本次快照的差异
+        """
+        self.snapshots += 1
+        diff = SnapshotDiff(self.snapshots)
+        removed: Dict[str, int] = {}
+        added: Dict[str, int] = {}
+        for rank, stack in enumerate(stacks):
+            signature = stack_signature(stack) if stack else None
+            old = self.signatures[rank]
+            if signature == old:
+                self.unchanged[rank] += 1
+                if signature is not None and self.unchanged[rank] >= self.stuck_threshold:
+                    diff.stuck_ranks |= 1 << rank
+                continue
+            self.unchanged[rank] = 0
+            self.signatures[rank] = signature
+            diff.moved[rank] = (old, signature)
+            if old is not None:
+                removed[old] = removed.get(old, 0) | (1 << rank)
+            if signature is not None:
+                self.stacks_by_signature.setdefault(signature, stack)
+                added[signature] = added.get(signature, 0) | (1 << rank)
+
+        frame_delta: Dict[str, int] = {}
+        for signature, mask in removed.items():
+            self._apply(signature, mask, -1, frame_delta, diff)
+        for signature, mask in added.items():
+            self._apply(signature, mask, 1, frame_delta, diff)
+
+        for frame, delta in frame_delta.items():
+            before = self.frame_refs.get(frame, 0)
+            after = before + delta
+            if after:
+                self.frame_refs[frame] = after
+            else:
+                self.frame_refs.pop(frame, None)
+            if before == 0 and after > 0:
+                diff.appeared_frames.append(frame)
+            elif before > 0 and after == 0:
+                diff.disappeared_frames.append(frame)
+
+        # 不再被任何rank引用的签名无需保留
+        for signature in removed:
+            if not self.signature_ranks.get(signature):
+                self.signature_ranks.pop(signature, None)
+                self.stacks_by_signature.pop(signature, None)
+
+        if diff.moved:
+            self.trie.clear_label_cache()
+            # remove_mask删除节点时不回收符号, 失效的帧积累到一定数量后重建符号表
+            live = len(self.frame_refs) + 1
+            if len(self.trie.symbols) > max(2 * live, COMPACT_MIN_SYMBOLS):
+                removed_symbols = self.trie.compact_symbols()
+                logger.debug(f"符号表已压缩, 删除 {removed_symbols} 个失效的帧")
+        return diff
+
+    def _apply(self, signature: str, mask: int, sign: int, frame_delta: Dict[str, int],
+               diff: SnapshotDiff) -> None:
+        stack = self.stacks_by_signature[signature]
+        diff.stacks[signature] = stack
+        count = bin(mask).count("1")
+        frames = stack.split(";")
+        if sign > 0:
+            self.trie.insert_mask(frames, mask, count=count)
+        else:
+            self.trie.remove_mask(frames, mask, count=count)
+
+        before = self.signature_ranks.get(signature, 0)
+        self.signature_ranks[signature] = before + sign * count
+        change = diff.changed_stacks.setdefault(stack, [before, before])
+        change[1] = before + sign * count
+
+        for frame in dict.fromkeys(frames):
+            if frame:
+                frame_delta[frame] = frame_delta.get(frame, 0) + sign * count
+
@@ -0,0 +1,178 @@
+import mmap
+import struct
+import sys
+from array import array
+from typing import Dict, Iterable, List
+
+# 文件布局(小端):
+#   头部      magic, 版本, rank数, 符号数, 各段偏移
+#   符号索引  (符号数 + 1) 个u64, 第i个符号占 [off[i], off[i+1]) 字节
+#   符号数据  UTF-8编码的帧字符串, 依次拼接
+#   rank索引  每个rank两个u32: 帧数组起点(以帧为单位)与帧数; 相同堆栈共享同一个帧数组,
+#             未采集到的rank起点为FAILED_SLOT, 帧数为0
+#   帧数据    u32帧ID, 自底向上
+MAGIC = b"STKSNAP1"
+VERSION = 1
+SNAPSHOT_SUFFIX = ".stk"
+FAILED_SLOT = 0xFFFFFFFF
+_HEADER = struct.Struct("<8sIIIIQQQQ")
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def _to_little_endian(values: array) -> bytes:
+    if sys.byteorder != "little":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def write_snapshot(path: str, stacks: List[str], failed_ranks: Iterable[int] = ()) -> None:
+    """把一次快照写成二进制格式
+
+    Args:
+        path: 目标文件名
+        stacks: 下标为rank的堆栈字符串(以 ; 结尾), 采集失败的rank为空字符串
+        failed_ranks: 没有采集到堆栈的rank, 重新读取时仍标注为未采集到
+    """
+    failed = set(failed_ranks)
+    symbol_ids: Dict[str, int] = {}
+    symbol_blobs: List[bytes] = []
+    symbol_offsets = array("Q", [0])
+    frames = array("I")
+    rank_index = array("I")
+    stack_slots: Dict[str, tuple] = {}
+
+    for rank, stack in enumerate(stacks):
+        if rank in failed:
+            rank_index.extend((FAILED_SLOT, 0))
+            continue
+        slot = stack_slots.get(stack)
+        if slot is None:
+            parts = stack.split(";")
+            if parts[-1] == "":
+                parts.pop()
+            start = len(frames)
+            for frame in parts:
+                frame_id = symbol_ids.get(frame)
+                if frame_id is None:
+                    frame_id = symbol_ids[frame] = len(symbol_blobs)
+                    blob = frame.encode("utf-8")
+                    symbol_blobs.append(blob)
+                    symbol_offsets.append(symbol_offsets[-1] + len(blob))
+                frames.append(frame_id)
+            slot = stack_slots[stack] = (start, len(parts))
+        rank_index.extend(slot)
+
+    symbol_index_offset = _align(_HEADER.size)
+    symbol_data_offset = symbol_index_offset + len(symbol_offsets) * 8
+    rank_index_offset = _align(symbol_data_offset + symbol_offsets[-1])
+    frame_data_offset = _align(rank_index_offset + len(rank_index) * 4)
+
+    with open(path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, len(stacks), len(symbol_blobs), 0,
+                             symbol_index_offset, symbol_data_offset, rank_index_offset, frame_data_offset))
+        f.write(b"\0" * (symbol_index_offset - f.tell()))
+        f.write(_to_little_endian(symbol_offsets))
+        for blob in symbol_blobs:
+            f.write(blob)
+        f.write(b"\0" * (rank_index_offset - f.tell()))
+        f.write(_to_little_endian(rank_index))
+        f.write(b"\0" * (frame_data_offset - f.tell()))
+        f.write(_to_little_endian(frames))
+
+
+def is_snapshot(path: str) -> bool:
+    """根据文件头判断是否为二进制快照"""
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+class SnapshotReader:
+    def __init__(self, path: str):
+        """通过mmap打开二进制快照, 打开时只解析头部, 其余内容按需读取
+
+        下标访问返回该rank的堆栈字符串, 可直接传给merge_stacks.
+
+        Args:
+            path: 快照文件名
+        """
+        if sys.byteorder != "little":
+            raise NotImplementedError("二进制快照目前只支持小端平台")
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.num_ranks, self.num_symbols, _, symbol_index_offset, self._symbol_data_offset,
+         rank_index_offset, frame_data_offset) = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"{path} 不是受支持的二进制快照")
+        self._view = view = memoryview(self._mmap)
+        self._symbol_offsets = view[symbol_index_offset:symbol_index_offset + (self.num_symbols + 1) * 8].cast("Q")
+        self._rank_index = view[rank_index_offset:rank_index_offset + self.num_ranks * 8].cast("I")
+        self._frames = view[frame_data_offset:].cast("I")
+        self._symbols: Dict[int, str] = {}
+
+    def symbol(self, frame_id: int) -> str:
+        """帧ID对应的帧字符串, 解码结果会被缓存"""
+        frame = self._symbols.get(frame_id)
+        if frame is None:
+            start = self._symbol_data_offset + self._symbol_offsets[frame_id]
+            end = self._symbol_data_offset + self._symbol_offsets[frame_id + 1]
+            frame = self._symbols[frame_id] = self._mmap[start:end].decode("utf-8")
+        return frame
+
+    def frame_ids(self, rank: int) -> memoryview:
+        """rank的帧ID数组(自底向上), 直接引用mmap中的数据; 未采集到的rank为空数组"""
+        start = self._rank_index[2 * rank]
+        if start == FAILED_SLOT:
+            return self._frames[0:0]
+        return self._frames[start:start + self._rank_index[2 * rank + 1]]
+
+    def failed_ranks(self) -> List[int]:
+        """没有采集到堆栈的rank"""
+        index = self._rank_index
+        return [rank for rank in range(self.num_ranks) if index[2 * rank] == FAILED_SLOT]
+
+    def __len__(self) -> int:
+        return self.num_ranks
+
+    def __getitem__(self, rank: int) -> str:
+        if not 0 <= rank < self.num_ranks:
+            raise IndexError(rank)
+        frames = [self.symbol(frame_id) for frame_id in self.frame_ids(rank)]
+        return "".join(f"{frame};" for frame in frames)
+
+    def group_stacks(self) -> Dict[str, int]:
+        """按堆栈对rank分组, 与tire_stack.group_stacks的结果一致
+
+        写入时相同的堆栈共享同一个帧数组, 这里只需比较rank索引, 每种堆栈只解码一次.
+        """
+        slots: Dict[tuple, int] = {}
+        index = self._rank_index
+        for rank in range(self.num_ranks):
+            slot = (index[2 * rank], index[2 * rank + 1])
+            slots[slot] = slots.get(slot, 0) | (1 << rank)
+        groups: Dict[str, int] = {}
+        for (start, length), mask in slots.items():
+            stack = "".join(f"{self.symbol(frame_id)};" for frame_id in self._frames[start:start + length])
+            groups[stack] = groups.get(stack, 0) | mask
+        return groups
+
+    def close(self) -> None:
+        for name in ("_symbol_offsets", "_rank_index", "_frames", "_view"):
+            view = getattr(self, name, None)
+            if view is not None:
+                view.release()
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
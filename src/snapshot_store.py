@@ -0,0 +1,742 @@
+import argparse
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+sys.path.append(".")
+from svg_renderer import FlameGraphRenderer
+from tire_stack import StackTrie, format_rank_ranges, stack_signature
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# 快照库目录布局(小端, 除meta.json外均只追加):
+#   meta.json     rank数与每段的样本数
+#   symbols.log   帧字符串, 每条为 u32长度 + UTF-8字节, 按出现顺序编号为帧ID
+#   stacks.log    去重后的堆栈, 每条为 u32帧数 + u32帧ID(自底向上), 按出现顺序编号为堆栈ID
+#   changes.log   每个样本中堆栈发生变化的rank, 每条为 u32 rank + u32堆栈ID; 每段的第一个样本记录所有rank
+#   samples.log   时间戳索引, 每个样本一条 f64时间戳 + u64该样本在changes.log中的结束位置(以条为单位)
+#   segments/     写满的段的区间索引, 见 _Segment
+STORE_VERSION = 1
+NO_STACK = 0xFFFFFFFF       # 采集失败或没有堆栈的rank
+_SAMPLE = struct.Struct("<dQ")
+_U32 = struct.Struct("<I")
+_SEGMENT_MAGIC = b"STKSEG01"
+_SEGMENT_HEADER = struct.Struct("<8sIIQIIIQ")
+_ITEMSIZE = {"B": 1, "I": 4, "Q": 8}
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def _segment_layout(num_ranks: int, num_stacks: int, num_intervals: int, mask_bytes: int) -> List[tuple]:
+    """段索引文件中各数组的 (名称, 类型码, 偏移, 长度)"""
+    sections = [
+        ("dir_stack", "I", num_stacks),         # 段内出现过的堆栈ID, 升序
+        ("dir_first", "I", num_stacks + 1),     # 每个堆栈的区间在区间表中的起点
+        ("dir_total", "Q", num_stacks),         # 每个堆栈在段内的 rank×样本数
+        ("mask_offsets", "Q", num_stacks + 1),  # 每个堆栈的rank位图在masks中的位置
+        ("masks", "B", mask_bytes),
+        ("iv_stack", "I", num_intervals),       # 区间表: rank在 [start, end) 样本内一直处于该堆栈
+        ("iv_rank", "I", num_intervals),
+        ("iv_start", "I", num_intervals),
+        ("iv_end", "I", num_intervals),
+        ("rank_order", "I", num_intervals),     # 按 (rank, start) 排序的区间下标
+        ("rank_first", "I", num_ranks + 1),     # 每个rank的区间在rank_order中的起点
+    ]
+    layout = []
+    offset = _align(_SEGMENT_HEADER.size)
+    for name, typecode, length in sections:
+        layout.append((name, typecode, offset, length))
+        offset = _align(offset + length * _ITEMSIZE[typecode])
+    return layout
+
+
+class _Segment:
+    """一段连续样本的区间索引
+
+    段内每个rank停留在同一堆栈的连续样本记为一个区间, 区间按堆栈ID排序并附带每个堆栈的汇总(rank×样本数与rank位图),
+    另有按rank排序的下标. 已写满的段保存为文件并通过mmap读取, 查询只触及用到的部分.
+    样本位置均为段内偏移.
+    """
+
+    def __init__(self, first: int, count: int, num_ranks: int, columns: Dict[str, object]):
+        self.first = first
+        self.count = count
+        self.num_ranks = num_ranks
+        self.columns = columns
+        for name, column in columns.items():
+            setattr(self, name, column)
+        self._positions: Optional[Dict[int, int]] = None
+        self._mmap = None
+        self._file = None
+
+    @classmethod
+    def from_intervals(cls, first: int, count: int, num_ranks: int, intervals: List[tuple]) -> "_Segment":
+        """由 (堆栈ID, rank, start, end) 区间列表构建"""
+        intervals.sort()
+        columns = {name: array(typecode) for name, typecode, _, _ in _segment_layout(0, 0, 0, 0)}
+        columns["masks"] = bytearray()
+        dir_first, mask_offsets = columns["dir_first"], columns["mask_offsets"]
+        mask_offsets.append(0)
+        current = None
+        total = mask = 0
+        for index, (stack_id, rank, start, end) in enumerate(intervals):
+            if stack_id != current:
+                if current is not None:
+                    cls._close_stack(columns, total, mask)
+                columns["dir_stack"].append(stack_id)
+                dir_first.append(index)
+                current = stack_id
+                total = mask = 0
+            total += end - start
+            mask |= 1 << rank
+            columns["iv_stack"].append(stack_id)
+            columns["iv_rank"].append(rank)
+            columns["iv_start"].append(start)
+            columns["iv_end"].append(end)
+        if current is not None:
+            cls._close_stack(columns, total, mask)
+        dir_first.append(len(intervals))
+
+        iv_rank, iv_start = columns["iv_rank"], columns["iv_start"]
+        columns["rank_order"] = array("I", sorted(range(len(intervals)), key=lambda i: (iv_rank[i], iv_start[i])))
+        rank_first = array("I", [0]) * (num_ranks + 1)
+        for rank in iv_rank:
+            rank_first[rank + 1] += 1
+        for rank in range(num_ranks):
+            rank_first[rank + 1] += rank_first[rank]
+        columns["rank_first"] = rank_first
+        return cls(first, count, num_ranks, columns)
+
+    @staticmethod
+    def _close_stack(columns: Dict[str, object], total: int, mask: int) -> None:
+        columns["dir_total"].append(total)
+        columns["masks"] += mask.to_bytes((mask.bit_length() + 7) // 8, "little")
+        columns["mask_offsets"].append(len(columns["masks"]))
+
+    @classmethod
+    def open(cls, path: str) -> "_Segment":
+        """通过mmap打开段索引文件"""
+        f = open(path, "rb")
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, _, count, first, num_ranks, num_stacks, num_intervals, mask_bytes = \
+            _SEGMENT_HEADER.unpack_from(mm, 0)
+        if magic != _SEGMENT_MAGIC:
+            mm.close()
+            f.close()
+            raise ValueError(f"{path} 不是快照库的段索引")
+        view = memoryview(mm)
+        columns = {}
+        for name, typecode, offset, length in _segment_layout(num_ranks, num_stacks, num_intervals, mask_bytes):
+            columns[name] = view[offset:offset + length * _ITEMSIZE[typecode]].cast(typecode)
+        columns["_view"] = view
+        segment = cls(first, count, num_ranks, columns)
+        segment._mmap = mm
+        segment._file = f
+        return segment
+
+    def save(self, path: str) -> None:
+        """写入段索引文件, 先写临时文件再改名, 中断时不会留下不完整的索引"""
+        num_stacks = len(self.dir_stack)
+        layout = _segment_layout(self.num_ranks, num_stacks, len(self.iv_stack), len(self.masks))
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(_SEGMENT_HEADER.pack(_SEGMENT_MAGIC, STORE_VERSION, self.count, self.first, self.num_ranks,
+                                         num_stacks, len(self.iv_stack), len(self.masks)))
+            for name, _, offset, _ in layout:
+                f.write(b"\0" * (offset - f.tell()))
+                f.write(bytes(self.columns[name]))
+        os.replace(tmp_path, path)
+
+    def position(self, stack_id: int) -> Optional[int]:
+        """堆栈在段目录中的位置, 段内没有该堆栈时返回None"""
+        if self._positions is None:
+            self._positions = {stack: index for index, stack in enumerate(self.dir_stack)}
+        return self._positions.get(stack_id)
+
+    def mask(self, position: int) -> int:
+        return int.from_bytes(self.masks[self.mask_offsets[position]:self.mask_offsets[position + 1]], "little")
+
+    def stack_intervals(self, position: int) -> range:
+        """该堆栈的区间下标"""
+        return range(self.dir_first[position], self.dir_first[position + 1])
+
+    def rank_intervals(self, rank: int):
+        """该rank的区间下标, 按起点排序"""
+        return self.rank_order[self.rank_first[rank]:self.rank_first[rank + 1]]
+
+    def close(self) -> None:
+        if self._mmap is None:
+            return
+        for name, column in self.columns.items():
+            if name != "_view":
+                column.release()
+        self.columns["_view"].release()
+        self._mmap.close()
+        self._file.close()
+        self._mmap = None
+
+
+class SnapshotStore:
+    def __init__(self, path: str, num_ranks: Optional[int] = None, segment_samples: int = 600,
+                 cache_size: int = 16):
+        """只追加的集群快照时序库
+
+        每个样本只记录堆栈发生变化的rank, 相同的堆栈与帧只保存一次. 每 segment_samples 个样本为一段,
+        段写满时生成区间索引, 之后的查询只读取时间范围内各段的索引, 不需要重放快照.
+        索引包括: 时间戳 -> 样本(samples.log), 帧 -> 堆栈(内存中), 堆栈 -> 区间与rank -> 区间(段索引).
+
+        Args:
+            path: 快照库目录, 不存在时创建
+            num_ranks: rank总数, 创建新库时必须指定, 打开已有的库时须与库中的一致
+            segment_samples: 每段的样本数, 只在创建新库时生效
+            cache_size: 最多同时打开的段索引数
+        """
+        if sys.byteorder != "little":
+            raise NotImplementedError("快照库目前只支持小端平台")
+        self.path = path
+        meta_path = os.path.join(path, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta["version"] != STORE_VERSION:
+                raise ValueError(f"{path} 的快照库版本 {meta['version']} 不受支持")
+            if num_ranks is not None and num_ranks != meta["num_ranks"]:
+                raise ValueError(f"快照库 {path} 有 {meta['num_ranks']} 个rank, 本次采集有 {num_ranks} 个")
+        else:
+            if num_ranks is None:
+                raise FileNotFoundError(f"{path} 中没有快照库")
+            os.makedirs(os.path.join(path, "segments"), exist_ok=True)
+            meta = {"version": STORE_VERSION, "num_ranks": num_ranks, "segment_samples": segment_samples}
+            with open(meta_path, "w") as f:
+                json.dump(meta, f)
+        self.num_ranks = meta["num_ranks"]
+        self.segment_samples = meta["segment_samples"]
+        self.cache_size = cache_size
+
+        self.symbols: List[str] = []
+        self._symbol_ids: Dict[str, int] = {}
+        self._stacks: List[array] = []
+        self._stack_ids: Dict[str, int] = {}
+        self._frame_stacks: Dict[int, List[int]] = {}
+        self.timestamps = array("d")
+        self._change_ends = array("Q")
+        self._load()
+
+        self._symbol_log = open(self._file("symbols.log"), "ab")
+        self._stack_log = open(self._file("stacks.log"), "ab")
+        self._change_log = open(self._file("changes.log"), "ab")
+        self._sample_log = open(self._file("samples.log"), "ab")
+        self._segments: "OrderedDict[int, _Segment]" = OrderedDict()
+        # 上一个样本各rank的堆栈字符串与ID, 未变化的rank无需重新计算签名
+        self._last_stacks: List[Optional[str]] = [None] * self.num_ranks
+        self._last_ids = array("I", [NO_STACK]) * self.num_ranks
+
+        sealed = len(self.timestamps) // self.segment_samples
+        for segment in range(sealed):
+            # 写满后未来得及生成索引的段, 从changes.log重建
+            if not os.path.exists(self._segment_file(segment)):
+                first = segment * self.segment_samples
+                self._replay(first, first + self.segment_samples)
+                self._seal(segment)
+        self._segment_first = sealed * self.segment_samples
+        self._replay(self._segment_first, len(self.timestamps))
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _segment_file(self, segment: int) -> str:
+        return os.path.join(self.path, "segments", f"{segment:06d}.seg")
+
+    @staticmethod
+    def _read_records(path: str, parse) -> bool:
+        """依次解析日志中的完整记录, 截掉末尾写了一半或无效的记录
+
+        Args:
+            path: 日志文件名
+            parse: 解析一条记录, 返回记录的结束位置; 记录无效时返回None
+
+        Returns:
+            是否截掉了记录
+        """
+        if not os.path.exists(path):
+            return False
+        with open(path, "rb") as f:
+            data = f.read()
+        pos = 0
+        while pos + _U32.size <= len(data):
+            end = parse(data, pos)
+            if end is None or end > len(data):
+                break
+            pos = end
+        if pos == len(data):
+            return False
+        with open(path, "r+b") as f:
+            f.truncate(pos)
+        return True
+
+    def _load(self) -> None:
+        def parse_symbol(data, pos):
+            end = pos + _U32.size + _U32.unpack_from(data, pos)[0]
+            if end <= len(data):
+                self._add_symbol(data[pos + _U32.size:end].decode("utf-8"))
+            return end
+
+        def parse_stack(data, pos):
+            end = pos + _U32.size * (1 + _U32.unpack_from(data, pos)[0])
+            if end <= len(data):
+                frame_ids = array("I", data[pos + _U32.size:end])
+                # 引用的帧没有写入symbols.log时, 从这条堆栈开始都无效
+                if frame_ids and max(frame_ids) >= len(self.symbols):
+                    return None
+                self._add_stack(frame_ids)
+            return end
+
+        truncated = self._read_records(self._file("symbols.log"), parse_symbol)
+        truncated = self._read_records(self._file("stacks.log"), parse_stack) or truncated
+
+        sample_path = self._file("samples.log")
+        if os.path.exists(sample_path):
+            with open(sample_path, "rb") as f:
+                data = f.read()
+            complete = len(data) - len(data) % _SAMPLE.size
+            for timestamp, change_end in _SAMPLE.iter_unpack(data[:complete]):
+                self.timestamps.append(timestamp)
+                self._change_ends.append(change_end)
+            if complete != len(data):
+                with open(sample_path, "r+b") as f:
+                    f.truncate(complete)
+        # 最后一个样本之后的变化记录属于未写完的样本
+        change_path = self._file("changes.log")
+        end = (self._change_ends[-1] if self._change_ends else 0) * 8
+        if os.path.exists(change_path) and os.path.getsize(change_path) > end:
+            with open(change_path, "r+b") as f:
+                f.truncate(end)
+        if truncated and self._change_ends:
+            self._drop_dangling_samples()
+
+    def _drop_dangling_samples(self) -> None:
+        """堆栈日志末尾有记录丢失时, 丢弃从第一个引用了丢失堆栈的样本开始的所有样本
+
+        只在打开库时发现日志被截断后调用, 需要读取整个changes.log.
+        """
+        changes = array("I")
+        with open(self._file("changes.log"), "rb") as f:
+            changes.frombytes(f.read())
+        num_stacks = len(self._stacks)
+        for k in range(1, len(changes), 2):
+            if num_stacks <= changes[k] != NO_STACK:
+                break
+        else:
+            return
+        keep = bisect_right(self._change_ends, k // 2)
+        logger.warning(f"快照库 {self.path} 的堆栈日志不完整, 丢弃最后 {len(self.timestamps) - keep} 个样本")
+        del self.timestamps[keep:]
+        del self._change_ends[keep:]
+        with open(self._file("samples.log"), "r+b") as f:
+            f.truncate(keep * _SAMPLE.size)
+        with open(self._file("changes.log"), "r+b") as f:
+            f.truncate((self._change_ends[-1] if keep else 0) * 8)
+        # 包含被丢弃样本的段索引已失效
+        segment_dir = os.path.join(self.path, "segments")
+        for name in os.listdir(segment_dir):
+            if name.endswith(".seg") and int(name[:-len(".seg")]) >= keep // self.segment_samples:
+                os.remove(os.path.join(segment_dir, name))
+
+    def _add_symbol(self, frame: str) -> int:
+        frame_id = self._symbol_ids[frame] = len(self.symbols)
+        self.symbols.append(frame)
+        return frame_id
+
+    def _add_stack(self, frame_ids: array, signature: Optional[str] = None) -> int:
+        stack_id = len(self._stacks)
+        self._stacks.append(frame_ids)
+        self._stack_ids[signature or stack_signature(self.stack(stack_id))] = stack_id
+        for frame_id in set(frame_ids):
+            self._frame_stacks.setdefault(frame_id, []).append(stack_id)
+        return stack_id
+
+    def _intern_stack(self, stack: str) -> int:
+        """堆栈字符串对应的堆栈ID, 首次出现时写入stacks.log"""
+        if not stack:
+            return NO_STACK
+        signature = stack_signature(stack)
+        stack_id = self._stack_ids.get(signature)
+        if stack_id is not None:
+            return stack_id
+        parts = stack.split(";")
+        if parts[-1] == "":
+            parts.pop()
+        frame_ids = array("I")
+        for frame in parts:
+            frame_id = self._symbol_ids.get(frame)
+            if frame_id is None:
+                frame_id = self._add_symbol(frame)
+                blob = frame.encode("utf-8")
+                self._symbol_log.write(_U32.pack(len(blob)) + blob)
+            frame_ids.append(frame_id)
+        # 帧先于引用它们的堆栈落盘, 中断时stacks.log不会引用不存在的帧
+        self._symbol_log.flush()
+        self._stack_log.write(_U32.pack(len(frame_ids)) + frame_ids.tobytes())
+        return self._add_stack(frame_ids, signature)
+
+    def stack(self, stack_id: int) -> str:
+        """堆栈ID对应的堆栈字符串(以 ; 结尾)"""
+        if stack_id == NO_STACK:
+            return ""
+        return "".join(f"{self.symbols[frame_id]};" for frame_id in self._stacks[stack_id])
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def _move(self, rank: int, stack_id: int, offset: int) -> None:
+        """rank在段内偏移offset处切换到stack_id, 结束它之前所在的区间"""
+        old = self._state[rank]
+        if stack_id == old:
+            return
+        if old != NO_STACK:
+            self._closed.append((old, rank, self._since[rank], offset))
+        self._state[rank] = stack_id
+        self._since[rank] = offset
+
+    def _replay(self, first: int, end: int) -> None:
+        """从changes.log重放 [first, end) 的样本, 恢复当前段的状态"""
+        self._state = array("I", [NO_STACK]) * self.num_ranks
+        self._since = array("I", [0]) * self.num_ranks
+        self._closed: List[tuple] = []
+        if first == end:
+            return
+        base = self._change_ends[first - 1] if first else 0
+        changes = array("I")
+        with open(self._file("changes.log"), "rb") as f:
+            f.seek(base * 8)
+            changes.frombytes(f.read((self._change_ends[end - 1] - base) * 8))
+        pos = 0
+        for index in range(first, end):
+            stop = (self._change_ends[index] - base) * 2
+            for k in range(pos, stop, 2):
+                self._move(changes[k], changes[k + 1], index - first)
+            pos = stop
+
+    def _open_intervals(self, count: int) -> List[tuple]:
+        intervals = list(self._closed)
+        for rank, stack_id in enumerate(self._state):
+            if stack_id != NO_STACK:
+                intervals.append((stack_id, rank, self._since[rank], count))
+        return intervals
+
+    def _seal(self, segment: int) -> None:
+        first = segment * self.segment_samples
+        _Segment.from_intervals(first, self.segment_samples, self.num_ranks,
+                                self._open_intervals(self.segment_samples)).save(self._segment_file(segment))
+        self._state = array("I", [NO_STACK]) * self.num_ranks
+        self._since = array("I", [0]) * self.num_ranks
+        self._closed = []
+        self._segment_first = first + self.segment_samples
+
+    def append(self, stacks: List[str], timestamp: Optional[float] = None) -> None:
+        """追加一次快照
+
+        Args:
+            stacks: 下标为rank的堆栈字符串(以 ; 结尾), 采集失败的rank为空字符串
+            timestamp: 采集时间(秒), 为空时取当前时间; 必须不早于上一个样本
+        """
+        if len(stacks) != self.num_ranks:
+            raise ValueError(f"快照有 {len(stacks)} 个rank, 快照库有 {self.num_ranks} 个")
+        if timestamp is None:
+            timestamp = time.time()
+        if self.timestamps and timestamp < self.timestamps[-1]:
+            raise ValueError("快照的时间戳早于上一个样本")
+        index = len(self.timestamps)
+        offset = index - self._segment_first
+        # 每段的第一个样本记录所有rank, 段可以独立重放
+        keyframe = offset == 0
+        changes = array("I")
+        last_stacks, last_ids, state = self._last_stacks, self._last_ids, self._state
+        for rank, stack in enumerate(stacks):
+            if stack == last_stacks[rank]:
+                stack_id = last_ids[rank]
+            else:
+                stack_id = self._intern_stack(stack)
+                last_stacks[rank] = stack
+                last_ids[rank] = stack_id
+            if keyframe or stack_id != state[rank]:
+                changes.extend((rank, stack_id))
+                self._move(rank, stack_id, offset)
+        # 样本记录最后写入, 中断时打开库会丢弃没有样本记录的变化
+        self._symbol_log.flush()
+        self._stack_log.flush()
+        self._change_log.write(changes.tobytes())
+        self._change_log.flush()
+        change_end = (self._change_ends[-1] if self._change_ends else 0) + len(changes) // 2
+        self._sample_log.write(_SAMPLE.pack(timestamp, change_end))
+        self._sample_log.flush()
+        self.timestamps.append(timestamp)
+        self._change_ends.append(change_end)
+        if offset + 1 == self.segment_samples:
+            self._seal(index // self.segment_samples)
+
+    def _segment(self, segment: int) -> _Segment:
+        """段索引; 当前未写满的段由内存中的状态临时构建"""
+        first = segment * self.segment_samples
+        if first == self._segment_first:
+            count = len(self.timestamps) - first
+            return _Segment.from_intervals(first, count, self.num_ranks, self._open_intervals(count))
+        cached = self._segments.get(segment)
+        if cached is not None:
+            self._segments.move_to_end(segment)
+            return cached
+        cached = self._segments[segment] = _Segment.open(self._segment_file(segment))
+        if len(self._segments) > self.cache_size:
+            self._segments.popitem(last=False)[1].close()
+        return cached
+
+    def sample_range(self, start: Optional[float] = None, end: Optional[float] = None) -> Tuple[int, int]:
+        """时间范围 [start, end] 内的样本下标范围 [first, stop)"""
+        first = bisect_left(self.timestamps, start) if start is not None else 0
+        stop = bisect_right(self.timestamps, end) if end is not None else len(self.timestamps)
+        return first, max(first, stop)
+
+    def _segments_in(self, first: int, stop: int) -> Iterator[Tuple[_Segment, int, int]]:
+        """覆盖样本 [first, stop) 的各段, 以及范围在段内的偏移 [lo, hi)"""
+        if first >= stop:
+            return
+        size = self.segment_samples
+        for segment in range(first // size, (stop - 1) // size + 1):
+            base = segment * size
+            yield self._segment(segment), max(first, base) - base, min(stop, base + size) - base
+
+    def aggregate(self, start: Optional[float] = None, end: Optional[float] = None) -> StackTrie:
+        """时间范围内所有样本聚合成的火焰图, 与连续采样的结果一致
+
+        完整覆盖的段直接使用段目录中的汇总, 只有首尾两段需要裁剪区间.
+
+        Args:
+            start: 起始时间戳, 为空时从第一个样本开始
+            end: 结束时间戳(含), 为空时到最后一个样本
+
+        Returns:
+            每条堆栈的计数为 rank×样本数 的StackTrie
+        """
+        totals: Dict[int, int] = {}
+        masks: Dict[int, int] = {}
+        for segment, lo, hi in self._segments_in(*self.sample_range(start, end)):
+            if lo == 0 and hi == segment.count:
+                for position, stack_id in enumerate(segment.dir_stack):
+                    totals[stack_id] = totals.get(stack_id, 0) + segment.dir_total[position]
+                    masks[stack_id] = masks.get(stack_id, 0) | segment.mask(position)
+                continue
+            iv_start, iv_end = segment.iv_start, segment.iv_end
+            for index, stack_id in enumerate(segment.iv_stack):
+                overlap = min(iv_end[index], hi) - max(iv_start[index], lo)
+                if overlap > 0:
+                    totals[stack_id] = totals.get(stack_id, 0) + overlap
+                    masks[stack_id] = masks.get(stack_id, 0) | (1 << segment.iv_rank[index])
+        trie = StackTrie(set(range(self.num_ranks)))
+        for stack_id, total in totals.items():
+            trie.insert_mask(self.stack(stack_id).split(";"), masks[stack_id], count=total)
+        return trie
+
+    def stacks_at(self, timestamp: Optional[float] = None) -> List[str]:
+        """不晚于timestamp的最后一个样本中各rank的堆栈, 为空时取最新的样本"""
+        if not self.timestamps:
+            return [""] * self.num_ranks
+        index = bisect_right(self.timestamps, timestamp) - 1 if timestamp is not None else len(self.timestamps) - 1
+        if index < 0:
+            raise ValueError("快照库中没有该时间之前的样本")
+        segment = self._segment(index // self.segment_samples)
+        offset = index - segment.first
+        stacks = [""] * self.num_ranks
+        for interval in range(len(segment.iv_stack)):
+            if segment.iv_start[interval] <= offset < segment.iv_end[interval]:
+                stacks[segment.iv_rank[interval]] = self.stack(segment.iv_stack[interval])
+        return stacks
+
+    def stacks_with_frame(self, frame: str) -> List[int]:
+        """包含名称中含有frame的帧的堆栈ID(帧索引)"""
+        stack_ids = set()
+        for frame_id, symbol in enumerate(self.symbols):
+            if frame in symbol:
+                stack_ids.update(self._frame_stacks.get(frame_id, ()))
+        return sorted(stack_ids)
+
+    def _runs(self, intervals: List[tuple]) -> List[tuple]:
+        """合并同一rank首尾相接的区间, intervals为 (rank, start, end, stack_id) 全局样本下标"""
+        runs = []
+        for rank, start, end, stack_id in sorted(intervals):
+            if runs and runs[-1][0] == rank and runs[-1][2] >= start:
+                runs[-1][2] = max(runs[-1][2], end)
+                runs[-1][3] = stack_id
+            else:
+                runs.append([rank, start, end, stack_id])
+        return runs
+
+    def dwell(self, frame: str, min_samples: int = 1, start: Optional[float] = None,
+              end: Optional[float] = None) -> List[Dict[str, object]]:
+        """哪些rank连续至少min_samples个样本停留在含有frame的堆栈中
+
+        通过帧索引找到相关的堆栈, 再从各段目录中只读取这些堆栈的区间; 同一rank在多个含该帧的堆栈之间切换仍算连续.
+
+        Args:
+            frame: 帧名称的一部分, 如 all_reduce
+            min_samples: 最少连续样本数
+            start: 起始时间戳, 为空时从第一个样本开始
+            end: 结束时间戳(含), 为空时到最后一个样本
+
+        Returns:
+            按rank与起始时间排序的列表, 每项为 {rank, start, end, samples, stack}, start/end为首尾样本的时间戳,
+            stack为最后所在的堆栈
+        """
+        stack_ids = self.stacks_with_frame(frame)
+        intervals = []
+        for segment, lo, hi in self._segments_in(*self.sample_range(start, end)):
+            for stack_id in stack_ids:
+                position = segment.position(stack_id)
+                if position is None:
+                    continue
+                for index in segment.stack_intervals(position):
+                    begin, stop = max(segment.iv_start[index], lo), min(segment.iv_end[index], hi)
+                    if begin < stop:
+                        intervals.append((segment.iv_rank[index], segment.first + begin,
+                                          segment.first + stop, stack_id))
+        return [{"rank": rank, "start": self.timestamps[first], "end": self.timestamps[stop - 1],
+                 "samples": stop - first, "stack": self.stack(stack_id)}
+                for rank, first, stop, stack_id in self._runs(intervals) if stop - first >= min_samples]
+
+    def rank_timeline(self, rank: int, start: Optional[float] = None,
+                      end: Optional[float] = None) -> List[Dict[str, object]]:
+        """rank在时间范围内依次所处的堆栈(rank索引)
+
+        Returns:
+            按时间排序的列表, 每项为 {start, end, samples, stack}, 采集失败的样本不在其中
+        """
+        if not 0 <= rank < self.num_ranks:
+            raise IndexError(rank)
+        timeline = []
+        for segment, lo, hi in self._segments_in(*self.sample_range(start, end)):
+            for index in segment.rank_intervals(rank):
+                begin, stop = max(segment.iv_start[index], lo), min(segment.iv_end[index], hi)
+                if begin >= stop:
+                    continue
+                stack_id = segment.iv_stack[index]
+                first = segment.first + begin
+                # 跨段的同一堆栈接续为一项
+                if timeline and timeline[-1][1] == first and timeline[-1][2] == stack_id:
+                    timeline[-1][1] = segment.first + stop
+                else:
+                    timeline.append([first, segment.first + stop, stack_id])
+        return [{"start": self.timestamps[first], "end": self.timestamps[stop - 1], "samples": stop - first,
+                 "stack": self.stack(stack_id)} for first, stop, stack_id in timeline]
+
+    def disk_usage(self) -> int:
+        """快照库占用的磁盘字节数"""
+        total = 0
+        for root, _, files in os.walk(self.path):
+            total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+        return total
+
+    def close(self) -> None:
+        for log in (self._symbol_log, self._stack_log, self._change_log, self._sample_log):
+            log.close()
+        for segment in self._segments.values():
+            segment.close()
+        self._segments.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def parse_time(text: str, reference: Optional[float] = None) -> float:
+    """解析时间: 时间戳秒数, ISO格式(2025-06-04T10:00:00), 或只有时分秒(10:00)
+
+    只有时分秒时, 日期取reference(通常为库中第一个样本的时间)所在的日期.
+    """
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        pass
+    for fmt in ("%H:%M:%S", "%H:%M"):
+        try:
+            parsed = datetime.strptime(text, fmt).time()
+        except ValueError:
+            continue
+        day = datetime.fromtimestamp(reference if reference is not None else time.time()).date()
+        return datetime.combine(day, parsed).timestamp()
+    raise ValueError(f"无法解析时间: {text}")
+
+
+def _format_time(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="查询集群快照时序库")
+    parser.add_argument("store", help="快照库目录(main.py --store 写入)")
+    parser.add_argument("--from", dest="start", default=None, help="起始时间, 如 10:00 或 2025-06-04T10:00:00")
+    parser.add_argument("--to", dest="end", default=None, help="结束时间(含)")
+    parser.add_argument("--output", default=None, help="输出时间范围内聚合的火焰图(SVG)")
+    parser.add_argument("--folded", default=None, help="输出时间范围内聚合的折叠格式堆栈")
+    parser.add_argument("--dwell", default=None, help="列出连续停留在含有该帧的堆栈中的rank, 如 all_reduce")
+    parser.add_argument("--min-samples", type=int, default=10, help="--dwell 的最少连续样本数")
+    parser.add_argument("--rank", type=int, default=None, help="列出该rank依次所处的堆栈")
+    args = parser.parse_args()
+
+    with SnapshotStore(args.store) as store:
+        if not len(store):
+            logger.error(f"快照库 {args.store} 中没有样本")
+            return
+        reference = store.timestamps[0]
+        start = parse_time(args.start, reference) if args.start else None
+        end = parse_time(args.end, reference) if args.end else None
+        first, stop = store.sample_range(start, end)
+        logger.info(f"快照库共 {len(store)} 个样本({_format_time(store.timestamps[0])} ~ "
+                    f"{_format_time(store.timestamps[-1])}), 占用 {store.disk_usage() / 2 ** 20:.1f} MiB, "
+                    f"查询范围内 {stop - first} 个样本")
+
+        if args.dwell:
+            runs = store.dwell(args.dwell, args.min_samples, start, end)
+            mask = 0
+            for run in runs:
+                mask |= 1 << run["rank"]
+                print(f"rank {run['rank']}: {_format_time(run['start'])} ~ {_format_time(run['end'])}, "
+                      f"连续 {run['samples']} 个样本")
+            print(f"共 {bin(mask).count('1')} 个rank连续至少 {args.min_samples} 个样本停留在 {args.dwell}"
+                  + (f": @{format_rank_ranges(mask)}" if mask else ""))
+        if args.rank is not None:
+            for item in store.rank_timeline(args.rank, start, end):
+                frames = [frame for frame in item["stack"].split(";") if frame]
+                print(f"{_format_time(item['start'])} ~ {_format_time(item['end'])} "
+                      f"{item['samples']:>6} 个样本: {frames[-1] if frames else '<无堆栈>'}")
+        if args.output or args.folded:
+            trie = store.aggregate(start, end)
+            if args.output:
+                with open(args.output, "w") as out:
+                    FlameGraphRenderer(title="Cluster stack information").render(trie, out, weighted=True)
+                logger.info(f"火焰图已生成: {args.output}")
+            if args.folded:
+                with open(args.folded, "w") as out:
+                    trie.dump(out, weighted=True)
+                logger.info(f"折叠格式堆栈已保存到 {args.folded}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import codecs
+import json
+import re
+from typing import Any, Dict, Iterable, List
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+# 解析状态: 等待 [ / 等待首个帧或 ] / 等待帧 / 等待 , 或 ] / 已结束
+_EXPECT_ARRAY, _EXPECT_FIRST, _EXPECT_FRAME, _EXPECT_SEPARATOR, _DONE = range(5)
+
+
+class FrameStreamParser:
+    def __init__(self, keep_locals: bool = False):
+        """增量解析 /apis/pythonext/callstack 返回的帧列表
+
+        数据可以分块喂入, 每当一个CFrame/PyFrame完整到达就解析出来.
+        默认丢弃 locals, 缓冲区只保留尚未完整到达的那一个帧, 内存与响应体大小无关.
+
+        Args:
+            keep_locals: 是否保留PyFrame中的locals
+        """
+        self.keep_locals = keep_locals
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json = json.JSONDecoder()
+        self._buf = ""
+        self._state = _EXPECT_ARRAY
+        # 帧不完整时, 等缓冲区增长到该长度再重试, 保证大帧的重试总开销是线性的
+        self._retry_len = 0
+
+    def feed(self, chunk) -> List[Dict[str, Any]]:
+        """喂入一段数据
+
+        Args:
+            chunk: 响应体的一段, bytes或str
+
+        Returns:
+            本段数据中已完整解析的帧列表
+        """
+        if isinstance(chunk, bytes):
+            chunk = self._decoder.decode(chunk)
+        self._buf += chunk
+        frames: List[Dict[str, Any]] = []
+        if len(self._buf) >= self._retry_len:
+            self._scan(frames)
+        return frames
+
+    def close(self) -> List[Dict[str, Any]]:
+        """结束解析, 数据不完整或不是帧列表时抛出ValueError
+
+        Returns:
+            缓冲区中剩余的帧列表
+        """
+        self._buf += self._decoder.decode(b"", final=True)
+        self._retry_len = 0
+        frames: List[Dict[str, Any]] = []
+        self._scan(frames)
+        if self._state != _DONE or self._buf.strip():
+            raise ValueError("响应不是完整的堆栈帧列表")
+        return frames
+
+    def _scan(self, frames: List[Dict[str, Any]]) -> None:
+        buf = self._buf
+        pos = 0
+        while True:
+            pos = _WHITESPACE.match(buf, pos).end()
+            if pos == len(buf):
+                break
+            ch = buf[pos]
+            state = self._state
+            if state == _EXPECT_ARRAY:
+                if ch != "[":
+                    raise ValueError("响应不是堆栈帧列表")
+                self._state = _EXPECT_FIRST
+                pos += 1
+            elif ch == "]" and state in (_EXPECT_FIRST, _EXPECT_SEPARATOR):
+                self._state = _DONE
+                pos += 1
+            elif state == _EXPECT_SEPARATOR:
+                if ch != ",":
+                    raise ValueError("响应不是堆栈帧列表")
+                self._state = _EXPECT_FRAME
+                pos += 1
+            elif state in (_EXPECT_FIRST, _EXPECT_FRAME):
+                if ch != "{":
+                    raise ValueError("响应不是堆栈帧列表")
+                try:
+                    entry, pos = self._json.raw_decode(buf, pos)
+                except json.JSONDecodeError:
+                    # 帧还没有完整到达, 等待后续数据
+                    self._retry_len = 2 * (len(buf) - pos)
+                    break
+                frames.append(self._strip_locals(entry))
+                self._state = _EXPECT_SEPARATOR
+                self._retry_len = 0
+            else:
+                break
+        self._buf = buf[pos:]
+
+    def _strip_locals(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        if not self.keep_locals:
+            for frame in entry.values():
+                if isinstance(frame, dict):
+                    frame.pop("locals", None)
+        return entry
+
+
+def parse_frames(chunks: Iterable, keep_locals: bool = False) -> List[Dict[str, Any]]:
+    """从分块数据中流式解析出完整的帧列表
+
+    Args:
+        chunks: 响应体分块(bytes或str)的可迭代对象
+        keep_locals: 是否保留PyFrame中的locals
+
+    Returns:
+        帧列表, 格式与probing返回的一致
+    """
+    parser = FrameStreamParser(keep_locals=keep_locals)
+    frames: List[Dict[str, Any]] = []
+    for chunk in chunks:
+        frames.extend(parser.feed(chunk))
+    frames.extend(parser.close())
+    return frames
@@ -0,0 +1,240 @@
+import logging
+from xml.sax.saxutils import escape
+
+import sys
+sys.path.append(".")
+from tire_stack import format_rank_ranges
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# 悬停显示详情、点击缩放、ctrl-F搜索
+_SCRIPT = """<script type="text/ecmascript"><![CDATA[
+var details, unzoombtn, frames;
+function init(evt) {
+	details = document.getElementById("details").firstChild;
+	unzoombtn = document.getElementById("unzoom");
+	frames = Array.prototype.slice.call(document.getElementsByClassName("func_g"));
+	frames.forEach(function(g) {
+		var r = g.getElementsByTagName("rect")[0];
+		g.dataset.x = r.getAttribute("x");
+		g.dataset.w = r.getAttribute("width");
+	});
+}
+function s(node) { details.nodeValue = "Function: " + node.getElementsByTagName("title")[0].textContent; }
+function c() { details.nodeValue = " "; }
+function place(g, x, w) {
+	var r = g.getElementsByTagName("rect")[0], t = g.getElementsByTagName("text")[0];
+	var label = g.getElementsByTagName("title")[0].textContent.replace(/ \\([^(]*\\)$/, "");
+	r.setAttribute("x", x.toFixed(1));
+	r.setAttribute("width", w.toFixed(1));
+	t.setAttribute("x", (x + 3).toFixed(2));
+	var chars = Math.floor(w / (FONT_SIZE * FONT_WIDTH));
+	t.textContent = chars < 3 ? "" : (label.length > chars ? label.substring(0, chars - 2) + ".." : label);
+}
+function zoom(node) {
+	var x0 = parseFloat(node.dataset.x), w0 = parseFloat(node.dataset.w);
+	var y0 = parseFloat(node.getElementsByTagName("rect")[0].getAttribute("y"));
+	var ratio = (IMAGE_WIDTH - 2 * XPAD) / w0;
+	unzoombtn.style.opacity = "1.0";
+	frames.forEach(function(g) {
+		var x = parseFloat(g.dataset.x), w = parseFloat(g.dataset.w);
+		var y = parseFloat(g.getElementsByTagName("rect")[0].getAttribute("y"));
+		if (x + w <= x0 + 0.0001 || x >= x0 + w0 - 0.0001) { g.style.display = "none"; return; }
+		g.style.display = "";
+		g.style.opacity = y > y0 ? "0.5" : "1.0";
+		if (y > y0) { place(g, XPAD, IMAGE_WIDTH - 2 * XPAD); }
+		else { place(g, (x - x0) * ratio + XPAD, w * ratio); }
+	});
+}
+function unzoom() {
+	unzoombtn.style.opacity = "0.0";
+	frames.forEach(function(g) {
+		g.style.display = "";
+		g.style.opacity = "1.0";
+		place(g, parseFloat(g.dataset.x), parseFloat(g.dataset.w));
+	});
+}
+function search(term) {
+	var re = new RegExp(term);
+	frames.forEach(function(g) {
+		var r = g.getElementsByTagName("rect")[0];
+		if (r.dataset.fill === undefined) r.dataset.fill = r.getAttribute("fill");
+		r.setAttribute("fill", re.test(g.getElementsByTagName("title")[0].textContent) ? "rgb(230,0,230)" : r.dataset.fill);
+	});
+}
+window.addEventListener("keydown", function(e) {
+	if (e.keyCode === 114 || (e.ctrlKey && e.keyCode === 70)) {
+		e.preventDefault();
+		var term = prompt("Enter a search term (regexp allowed)", "");
+		if (term != null) search(term);
+	}
+});
+]]></script>
+"""
+
+
+def name_hash(name: str) -> float:
+    """根据帧名计算0~1之间的稳定值, 靠前的字符权重更大, 保证同一函数在不同火焰图中颜色一致"""
+    vector = 0.0
+    weight = 1.0
+    total = 1.0
+    mod = 10
+    for ch in name:
+        vector += (ord(ch) % mod) / (mod - 1) * weight
+        total += weight
+        weight *= 0.70
+        mod += 1
+        if mod > 12:
+            break
+    return 1 - vector / total
+
+
+def frame_color(name: str) -> str:
+    """Python帧为绿色, C++帧为黄色, 其余C帧为红色"""
+    v = name_hash(name)
+    # 去掉行号的帧标签形如 func (file.py)
+    if ".py:" in name or ".py)" in name:
+        r, g, b = 50 + int(60 * v), 200 + int(55 * v), 50 + int(60 * v)
+    elif "::" in name:
+        r = g = 175 + int(55 * v)
+        b = 50 + int(20 * v)
+    else:
+        r, g, b = 200 + int(55 * v), 50 + int(80 * v), 50 + int(80 * v)
+    return f"rgb({r},{g},{b})"
+
+
+class FlameGraphRenderer:
+    def __init__(self, title: str = "Cluster stack information", image_width: int = 1200,
+                 frame_height: int = 16, font_size: int = 12, font_width: float = 0.59,
+                 min_width: float = 0.1):
+        """初始化SVG火焰图渲染器
+
+        Args:
+            title: 火焰图标题
+            image_width: 图片宽度(像素)
+            frame_height: 每层帧的高度(像素)
+            font_size: 字体大小
+            font_width: 字符平均宽度与字体大小之比, 用于截断标签
+            min_width: 宽度小于该值(像素)的帧及其子树不再绘制
+        """
+        self.title = title
+        self.image_width = image_width
+        self.frame_height = frame_height
+        self.font_size = font_size
+        self.font_width = font_width
+        self.min_width = min_width
+        self.xpad = 10
+        self.ypad1 = font_size * 3
+        self.ypad2 = font_size * 2 + 10
+
+    @staticmethod
+    def _subtree_weights(trie, weighted: bool):
+        """后序遍历计算每个节点子树的样本数, 同时求最大深度"""
+        weights = {}
+        max_depth = 0
+        stack = [(trie.root, 0, False)]
+        while stack:
+            node, depth, visited = stack.pop()
+            if visited:
+                own = (node.count if weighted else 1) if node.is_end_of_stack else 0
+                weights[id(node)] = own + sum(weights[id(child)] for child in node.children.values())
+                continue
+            max_depth = max(max_depth, depth)
+            stack.append((node, depth, True))
+            for child in node.children.values():
+                stack.append((child, depth + 1, False))
+        return weights, max_depth
+
+    def render(self, trie, fp, weighted: bool = False) -> None:
+        """把StackTrie直接布局为SVG并写入文件
+
+        帧标签保留 @有该堆栈的rank|缺失该堆栈的rank 标注; 同层帧按名称排序,
+        与flamegraph.pl的布局一致.
+
+        Args:
+            trie: 合并后的StackTrie
+            fp: 已打开的文本文件
+            weighted: 为True时帧宽度按采样次数计算, 否则每条堆栈计为1
+        """
+        weights, max_depth = self._subtree_weights(trie, weighted)
+        total = weights[id(trie.root)]
+        # 部分rank未采集到时在标题下方注明, 与flamegraph.pl的--subtitle布局一致
+        failed_mask = getattr(trie, "failed_mask", 0)
+        subtitle = f"部分快照: 未采集到 rank {format_rank_ranges(failed_mask)}" if failed_mask else ""
+        ypad1 = self.ypad1 + (self.font_size * 2 if subtitle else 0)
+        image_height = (max_depth + 1) * self.frame_height + ypad1 + self.ypad2
+        width_per_sample = (self.image_width - 2 * self.xpad) / max(total, 1)
+        self._write_header(fp, image_height, subtitle)
+
+        # (节点, 标签, 深度, x坐标)
+        stack = [(trie.root, "all", 0, float(self.xpad))]
+        while stack:
+            node, label, depth, x = stack.pop()
+            weight = weights[id(node)]
+            width = weight * width_per_sample
+            if width < self.min_width:
+                continue
+            self._write_frame(fp, label, weight, total, x, width, depth, image_height)
+
+            children = [(trie.label(frame_id, child), child)
+                        for frame_id, child in node.children.items()]
+            children.sort(key=lambda item: item[0])
+            child_x = x
+            placed = []
+            for child_label, child in children:
+                placed.append((child, child_label, depth + 1, child_x))
+                child_x += weights[id(child)] * width_per_sample
+            stack.extend(reversed(placed))
+
+        fp.write("</svg>\n")
+
+    def _write_header(self, fp, image_height: int, subtitle: str = "") -> None:
+        width = self.image_width
+        fp.write('<?xml version="1.0" standalone="no"?>\n'
+                 '<!DOCTYPE svg PUBLIC "-//W3C//DTD SVG 1.1//EN" '
+                 '"http://www.w3.org/Graphics/SVG/1.1/DTD/svg11.dtd">\n'
+                 f'<svg version="1.1" width="{width}" height="{image_height}" onload="init(evt)" '
+                 f'viewBox="0 0 {width} {image_height}" xmlns="http://www.w3.org/2000/svg" '
+                 'xmlns:xlink="http://www.w3.org/1999/xlink">\n'
+                 '<defs>\n\t<linearGradient id="background" y1="0" y2="1" x1="0" x2="0">\n'
+                 '\t\t<stop stop-color="#eeeeee" offset="5%" />\n'
+                 '\t\t<stop stop-color="#eeeeb0" offset="95%" />\n'
+                 '\t</linearGradient>\n</defs>\n'
+                 '<style type="text/css">\n'
+                 '\t.func_g:hover { stroke:black; stroke-width:0.5; cursor:pointer; }\n'
+                 '</style>\n')
+        fp.write(_SCRIPT.replace("FONT_SIZE", str(self.font_size))
+                 .replace("FONT_WIDTH", str(self.font_width))
+                 .replace("IMAGE_WIDTH", str(width))
+                 .replace("XPAD", str(self.xpad)))
+        text = f'font-size="{self.font_size}" font-family="Verdana" fill="rgb(0,0,0)"'
+        fp.write(f'<rect x="0.0" y="0" width="{width}.0" height="{image_height}.0" fill="url(#background)" />\n'
+                 f'<text text-anchor="middle" x="{width / 2:.2f}" y="24" font-size="{self.font_size + 5}" '
+                 f'font-family="Verdana" fill="rgb(0,0,0)">{escape(self.title)}</text>\n')
+        if subtitle:
+            fp.write(f'<text text-anchor="middle" x="{width / 2:.2f}" y="{self.font_size * 4}" {text}>'
+                     f'{escape(subtitle)}</text>\n')
+        fp.write(f'<text x="{self.xpad:.2f}" y="{image_height - self.ypad2 / 2:.0f}" {text} id="details"> </text>\n'
+                 f'<text x="{self.xpad:.2f}" y="24" {text} id="unzoom" onclick="unzoom()" '
+                 'style="opacity:0.0;cursor:pointer">Reset Zoom</text>\n')
+
+    def _write_frame(self, fp, label: str, weight: int, total: int, x: float, width: float,
+                     depth: int, image_height: int) -> None:
+        y = image_height - self.ypad2 - (depth + 1) * self.frame_height + 1
+        chars = int(width / (self.font_size * self.font_width))
+        if chars < 3:
+            text = ""
+        elif len(label) > chars:
+            text = escape(label[:chars - 2]) + ".."
+        else:
+            text = escape(label)
+        fill = "rgb(255,130,130)" if depth == 0 else frame_color(label)
+        percent = "100" if depth == 0 else f"{100 * weight / total:.2f}"
+        fp.write('<g class="func_g" onmouseover="s(this)" onmouseout="c()" onclick="zoom(this)">\n'
+                 f'<title>{escape(label)} ({weight} samples, {percent}%)</title>'
+                 f'<rect x="{x:.1f}" y="{y}" width="{width:.1f}" height="{self.frame_height - 1}.0" '
+                 f'fill="{fill}" rx="2" ry="2" />\n'
+                 f'<text x="{x + 3:.2f}" y="{y + 10.5}" font-size="{self.font_size}" '
+                 f'font-family="Verdana" fill="rgb(0,0,0)">{text}</text>\n</g>\n')
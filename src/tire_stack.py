@@ -1,75 +1,484 @@
+import hashlib
+import re
+import sys
+
+
+def ranks_to_mask(ranks):
+    """把rank集合转换为位图, 第i位为1表示包含rank i"""
+    mask = 0
+    for rank in ranks:
+        mask |= 1 << rank
+    return mask
+
+
+def mask_to_ranks(mask):
+    """把rank位图转换为升序的rank列表"""
+    bits = bin(mask)[:1:-1]
+    return [rank for rank, bit in enumerate(bits) if bit == "1"]
+
+
+_RANK_RUN = re.compile("1+")
+
+
+def format_rank_ranges(mask):
+    """把rank位图格式化为 0-3/5/7-9 形式, 耗时与位图长度成线性"""
+    # bin()的结果反转后, 第i个字符即rank i
+    bits = bin(mask)[:1:-1]
+    str_buf = []
+    for run in _RANK_RUN.finditer(bits):
+        low, high = run.start(), run.end() - 1
+        str_buf.append(f"{low}-{high}" if low != high else str(low))
+    return "/".join(str_buf)
+
+
+def parse_rank_ranges(text, num_ranks=None):
+    """解析 0-3/5/7-9 形式(也接受逗号分隔)的rank范围, 返回rank位图
+
+    Args:
+        text: rank范围字符串
+        num_ranks: rank总数, 给出时超出范围的rank抛出ValueError, 避免构造过大的位图
+    """
+    mask = 0
+    for part in re.split("[/,]", text):
+        part = part.strip()
+        if not part:
+            continue
+        low, _, high = part.partition("-")
+        low = int(low)
+        high = int(high) if high else low
+        if high < low:
+            raise ValueError(f"无效的rank范围: {part}")
+        if num_ranks is not None and high >= num_ranks:
+            raise ValueError(f"rank范围 {part} 超出了rank总数 {num_ranks}")
+        mask |= ((1 << (high - low + 1)) - 1) << low
+    return mask
+
+
 class TrieNode:
+    # 节点数量与 rank数 x 栈深 同阶, 使用__slots__避免每个节点的__dict__开销
+    __slots__ = ("children", "is_end_of_stack", "ranks", "count")
+
     def __init__(self):
-        self.children = {}
+        self.children = {}  # 帧ID -> TrieNode
         self.is_end_of_stack = False
-        self.ranks = set()
+        self.ranks = 0  # rank位图
+        self.count = 0
 
     def add_rank(self, rank):
-        self.ranks.add(rank)
+        self.ranks |= 1 << rank
 
 class StackTrie:
     def __init__(self,all_ranks):
         self.root = TrieNode()
         self.all_ranks = all_ranks
+        self.all_ranks_mask = ranks_to_mask(all_ranks)
+        # 没有采集到堆栈的rank(超时或出错), 不计入缺失该堆栈的rank
+        self.failed_mask = 0
+        # 帧字符串驻留为整数ID, 相同的帧在整棵树中只保存一份
+        self.symbols = []
+        self.symbol_ids = {}
+        self._rank_str_cache = {}
+
+    def intern(self, frame):
+        """返回帧字符串对应的ID, 首次出现时加入符号表"""
+        frame_id = self.symbol_ids.get(frame)
+        if frame_id is None:
+            frame_id = len(self.symbols)
+            self.symbols.append(frame)
+            self.symbol_ids[frame] = frame_id
+        return frame_id
+
+    def clear_label_cache(self):
+        """丢弃已格式化的rank标注; 增量更新后旧的rank位图多半不会再出现"""
+        self._rank_str_cache.clear()
+
+    def compact_symbols(self):
+        """重建符号表, 去掉已不在树中的帧, 并按新ID重排各节点的children
+
+        Returns:
+            删除的符号数
+        """
+        remap = {}
+        symbols = []
+        pending = [self.root]
+        while pending:
+            node = pending.pop()
+            children = {}
+            for frame_id, child in node.children.items():
+                new_id = remap.get(frame_id)
+                if new_id is None:
+                    new_id = remap[frame_id] = len(symbols)
+                    symbols.append(self.symbols[frame_id])
+                children[new_id] = child
+                pending.append(child)
+            node.children = children
+        removed = len(self.symbols) - len(symbols)
+        self.symbols = symbols
+        self.symbol_ids = {frame: frame_id for frame_id, frame in enumerate(symbols)}
+        return removed
+
+    def set_failed_ranks(self, mask):
+        """设置没有采集到堆栈的rank位图, 这些rank单独标注在rank标注的第三段"""
+        if mask != self.failed_mask:
+            self.failed_mask = mask
+            self._rank_str_cache.clear()
 
-    def insert(self, stack, rank):
+    def insert(self, stack, rank, count=1):
+        self.insert_mask(stack, 1 << rank, count)
+
+    def insert_mask(self, stack, mask, count=1):
+        """插入一条堆栈, 并把mask中的所有rank记到路径上的每个节点
+
+        Args:
+            stack: 自底向上的帧字符串列表
+            mask: rank位图
+            count: 该堆栈的采样次数
+        """
+        symbol_ids = self.symbol_ids
         node = self.root
         for frame in stack:
-            if frame not in node.children:
-                node.children[frame] = TrieNode()
-            node = node.children[frame]
-            node.add_rank(rank)
+            frame_id = symbol_ids.get(frame)
+            if frame_id is None:
+                frame_id = self.intern(frame)
+            child = node.children.get(frame_id)
+            if child is None:
+                child = node.children[frame_id] = TrieNode()
+            child.ranks |= mask
+            node = child
         node.is_end_of_stack = True
-        node.add_rank(rank)
+        node.ranks |= mask
+        node.count += count
+
+    def remove_mask(self, stack, mask, count=1):
+        """撤销一次insert_mask: 从路径上的节点清除mask中的rank, 删除不再有rank经过的节点
+
+        Args:
+            stack: 插入时使用的帧字符串列表
+            mask: 要清除的rank位图
+            count: 要扣除的采样次数
+        """
+        path = []
+        node = self.root
+        for frame in stack:
+            frame_id = self.symbol_ids[frame]
+            node = node.children[frame_id]
+            path.append((frame_id, node))
+        node.count -= count
+        if node.count <= 0:
+            node.count = 0
+            node.is_end_of_stack = False
+
+        keep = ~mask
+        self.root.ranks &= keep
+        for _, node in path:
+            node.ranks &= keep
+        for depth in range(len(path) - 1, -1, -1):
+            frame_id, node = path[depth]
+            if node.ranks or node.children or node.is_end_of_stack:
+                break
+            parent = path[depth - 1][1] if depth else self.root
+            del parent.children[frame_id]
+
+    def subtree(self, prefix=(), mask=None):
+        """取出以prefix为前缀、只包含mask中rank的子树, 不修改当前trie
+
+        前缀上的祖先帧保留, rank标注按所选的rank重新计算; 与当前trie共享符号表, 结果只用于读取.
+
+        Args:
+            prefix: 自底向上的帧字符串(不含rank标注)序列, 为空时从根开始
+            mask: 只保留这些rank, 为空时保留所有rank
+
+        Returns:
+            新的StackTrie, prefix不存在或没有所选rank经过时返回None
+        """
+        keep = self.all_ranks_mask if mask is None else self.all_ranks_mask & mask
+        node = self.root
+        path = []
+        for frame in prefix:
+            frame_id = self.symbol_ids.get(frame)
+            node = node.children.get(frame_id) if frame_id is not None else None
+            if node is None or not node.ranks & keep:
+                return None
+            path.append(frame_id)
+
+        trie = StackTrie(set(mask_to_ranks(keep)))
+        trie.symbols = self.symbols
+        trie.symbol_ids = self.symbol_ids
+        trie.set_failed_ranks(self.failed_mask & keep)
+
+        top = TrieNode()
+        top.ranks = node.ranks & keep
+        pending = [(node, top)]
+        while pending:
+            src, dst = pending.pop()
+            passing = 0
+            for frame_id, child in src.children.items():
+                passing |= child.ranks
+                ranks = child.ranks & keep
+                if ranks:
+                    copy = dst.children[frame_id] = TrieNode()
+                    copy.ranks = ranks
+                    pending.append((child, copy))
+            if src.is_end_of_stack:
+                count = src.count if mask is None else self._filtered_count(src, src.ranks & ~passing, keep)
+                if count:
+                    dst.is_end_of_stack = True
+                    dst.count = count
+
+        if not path:
+            trie.root = top
+            return trie
+        parent = trie.root
+        for frame_id in path[:-1]:
+            ancestor = parent.children[frame_id] = TrieNode()
+            ancestor.ranks = top.ranks
+            parent = ancestor
+        parent.children[path[-1]] = top
+        return trie
+
+    @staticmethod
+    def _filtered_count(node, ending, keep):
+        """按保留的rank比例折算堆栈末端节点的采样次数"""
+        base = ending or node.ranks
+        kept = base & keep
+        if not kept:
+            return 0
+        return max(1, node.count * bin(kept).count("1") // bin(base).count("1"))
+
+    def stats(self):
+        """trie的规模统计: 节点数、不同堆栈数、最大深度、符号数与估算的内存占用(字节)"""
+        nodes = 0
+        unique_stacks = 0
+        max_depth = 0
+        memory = sys.getsizeof(self.symbols) + sys.getsizeof(self.symbol_ids)
+        memory += sum(sys.getsizeof(symbol) for symbol in self.symbols)
+        pending = [(self.root, 0)]
+        while pending:
+            node, depth = pending.pop()
+            nodes += 1
+            max_depth = max(max_depth, depth)
+            if node.is_end_of_stack:
+                unique_stacks += 1
+            memory += sys.getsizeof(node) + sys.getsizeof(node.children) + sys.getsizeof(node.ranks)
+            for child in node.children.values():
+                pending.append((child, depth + 1))
+        return {"nodes": nodes - 1, "unique_stacks": unique_stacks, "max_depth": max_depth,
+                "symbols": len(self.symbols), "memory_bytes": memory}
 
     def _format_rank_str(self, ranks):
-        ranks = sorted(ranks)
-        leak_ranks = sorted(self.all_ranks - set(ranks))  # 将 ranks 转换为集合
-
-        def _inner_format(ranks):
-            str_buf = []
-            low = 0
-            high = 0
-            total = len(ranks)
-            while high < total - 1:
-                low_value = ranks[low]
-                high_value = ranks[high]
-                while high < total - 1 and high_value + 1 == ranks[high + 1]:
-                    high += 1
-                    high_value = ranks[high]
-                low = high + 1
-                high += 1
-                if low_value != high_value:
-                    str_buf.append(f"{low_value}-{high_value}")
-                else:
-                    str_buf.append(str(low_value))
-            if high == total - 1:
-                str_buf.append(str(ranks[high]))
-            return "/".join(str_buf)
-
-        has_stack_ranks = _inner_format(ranks)
-        leak_stack_ranks = _inner_format(leak_ranks)
-        return f"@{'|'.join([has_stack_ranks, leak_stack_ranks])}"
-
-    def _traverse_with_all_stack(self, node, path):
-        for frame, child in node.children.items():
-            rank_str = self._format_rank_str(child.ranks)
+        """把rank位图格式化为 @有该堆栈的rank|缺失该堆栈的rank
+
+        有rank没有采集到堆栈时追加第三段: @有|缺失|未采集到.
+        结果按位图缓存, 根节点附近rank集合相同的节点只格式化一次.
+        """
+        rank_str = self._rank_str_cache.get(ranks)
+        if rank_str is None:
+            parts = [format_rank_ranges(ranks),
+                     format_rank_ranges(self.all_ranks_mask & ~ranks & ~self.failed_mask)]
+            if self.failed_mask:
+                parts.append(format_rank_ranges(self.failed_mask))
+            rank_str = f"@{'|'.join(parts)}"
+            self._rank_str_cache[ranks] = rank_str
+        return rank_str
+
+    def label(self, frame_id, node):
+        """帧的显示名: 帧字符串加上rank标注"""
+        return self.symbols[frame_id] + self._format_rank_str(node.ranks)
+
+    def _traverse_with_all_stack(self):
+        """非递归的深度优先遍历
+
+        path是复用的片段缓冲区, 每个节点的片段(含分隔符与rank标注)只生成一次,
+        产出的path在下一次迭代时会被修改.
+        """
+        path = []
+        iterators = [iter(self.root.children.items())]
+        while iterators:
+            item = next(iterators[-1], None)
+            if item is None:
+                iterators.pop()
+                if path:
+                    path.pop()
+                continue
+            frame_id, child = item
+            segment = self.label(frame_id, child)
+            path.append(";" + segment if path else segment)
             if child.is_end_of_stack:
-                yield ";".join(path + [frame]) + rank_str
-            frame += rank_str
-            yield from self._traverse_with_all_stack(child, path + [frame])
+                yield path, child.count
+            iterators.append(iter(child.children.items()))
+
+    def iter_weighted(self):
+        """遍历合并后的堆栈, 同时给出每条堆栈的采样次数"""
+        for path, count in self._traverse_with_all_stack():
+            yield "".join(path), count
+
+    def dump(self, fp, weighted=False):
+        """把合并后的堆栈以折叠格式直接写入文件
+
+        Args:
+            fp: 已打开的文本文件
+            weighted: 为True时写入每条堆栈的采样次数, 否则每条堆栈计为1
+        """
+        for path, count in self._traverse_with_all_stack():
+            fp.writelines(path)
+            fp.write(f"; {count if weighted else 1}\n")
 
     def __iter__(self):
-        yield from self._traverse_with_all_stack(self.root, [])
+        for stack, _ in self.iter_weighted():
+            yield stack
 
-def merge_stacks(stacks):
-    all_ranks = set(range(len(stacks)))
-    trie = StackTrie(all_ranks)
+def group_stacks(stacks):
+    """按堆栈内容对rank分组
+
+    Args:
+        stacks: 下标为rank的堆栈字符串列表
+
+    Returns:
+        堆栈字符串 -> rank位图, 按每组最小rank的顺序排列
+    """
+    groups = {}
     for rank, stack in enumerate(stacks):
-        stack_frames = stack.split(";")
-        trie.insert(stack_frames, rank)
+        groups[stack] = groups.get(stack, 0) | (1 << rank)
+    return groups
+
+def stack_signature(stack):
+    """堆栈的短签名, 用于在汇总表中标识不同的堆栈"""
+    return hashlib.blake2b(stack.encode("utf-8"), digest_size=8).hexdigest()
+
+def merge_signature_maps(maps):
+    """合并多个 堆栈 -> rank位图 的分组结果
+
+    合并满足结合律; 按rank顺序依次合并各分片时, 结果(含顺序)与直接对所有rank分组一致.
+
+    Args:
+        maps: group_stacks格式的分组结果序列
+
+    Returns:
+        合并后的分组结果
+    """
+    merged = {}
+    for groups in maps:
+        for stack, mask in groups.items():
+            merged[stack] = merged.get(stack, 0) | mask
+    return merged
+
+def trie_from_groups(groups, num_ranks, failed_mask=0):
+    """由 堆栈 -> rank位图 的分组结果构建StackTrie, 每种堆栈只插入一次
+
+    Args:
+        groups: group_stacks格式的分组结果, 空字符串表示没有堆栈
+        num_ranks: rank总数
+        failed_mask: 没有采集到堆栈的rank位图
+    """
+    trie = StackTrie(set(range(num_ranks)))
+    trie.set_failed_ranks(failed_mask)
+    for stack, mask in groups.items():
+        if stack:
+            trie.insert_mask(stack.split(";"), mask, count=bin(mask).count("1"))
+    return trie
+
+def merge_stacks(stacks, failed_ranks=()):
+    """合并所有rank的堆栈, 相同的堆栈只插入一次
+
+    合并耗时与不同堆栈的数量成正比, 结果与逐个rank插入完全一致.
+
+    Args:
+        stacks: 下标为rank的堆栈字符串序列, 空字符串表示该rank没有堆栈;
+            也可以是自带group_stacks()的对象(如SnapshotReader)
+        failed_ranks: 没有采集到堆栈的rank, 在rank标注中单独列出
+    """
+    groups = stacks.group_stacks() if hasattr(stacks, "group_stacks") else group_stacks(stacks)
+    return trie_from_groups(groups, len(stacks), ranks_to_mask(failed_ranks))
+
+def stacks_to_partial(stacks, ranks, failed_ranks=()):
+    """把一个节点内各rank的堆栈预合并为紧凑的部分结果, 供上层合并
+
+    Args:
+        stacks: 与ranks一一对应的堆栈字符串, 采集失败的rank为空字符串
+        ranks: 各堆栈对应的全局rank
+        failed_ranks: 没有采集到堆栈的全局rank
+
+    Returns:
+        {"ranks": 节点负责的全局rank,
+         "failed": 十六进制的未采集到rank位图,
+         "symbols": 帧字符串表,
+         "stacks": [[帧ID列表, 十六进制rank位图, 采样次数], ...]}
+    """
+    groups = {}
+    for rank, stack in zip(ranks, stacks):
+        if stack:
+            groups[stack] = groups.get(stack, 0) | (1 << rank)
+
+    symbols = []
+    symbol_ids = {}
+    partial_stacks = []
+    for stack, mask in groups.items():
+        frame_ids = []
+        for frame in stack.split(";"):
+            frame_id = symbol_ids.get(frame)
+            if frame_id is None:
+                frame_id = symbol_ids[frame] = len(symbols)
+                symbols.append(frame)
+            frame_ids.append(frame_id)
+        partial_stacks.append([frame_ids, format(mask, "x"), bin(mask).count("1")])
+    return {"ranks": list(ranks), "failed": format(ranks_to_mask(failed_ranks), "x"),
+            "symbols": symbols, "stacks": partial_stacks}
+
+def merge_partials(partials, all_ranks=None):
+    """合并各节点的部分结果
+
+    各节点按最小rank依次插入, 节点内rank连续时结果与直接合并所有rank一致.
+
+    Args:
+        partials: stacks_to_partial生成的部分结果列表
+        all_ranks: 集群的全部rank; 没有部分结果覆盖的rank(如聚合代理不可达)记为未采集到.
+            为空时只包含各部分结果上报的rank
+
+    Returns:
+        合并后的StackTrie, 未采集到的rank单独标注
+    """
+    reported = set()
+    failed_mask = 0
+    for partial in partials:
+        reported.update(partial["ranks"])
+        failed_mask |= int(partial.get("failed", "0"), 16)
+    if all_ranks is None:
+        all_ranks = reported
+    else:
+        all_ranks = set(all_ranks)
+        failed_mask |= ranks_to_mask(all_ranks - reported)
+    trie = StackTrie(all_ranks)
+    trie.set_failed_ranks(failed_mask)
+    for partial in sorted(partials, key=lambda p: min(p["ranks"], default=0)):
+        symbols = partial["symbols"]
+        for frame_ids, mask, count in partial["stacks"]:
+            trie.insert_mask([symbols[frame_id] for frame_id in frame_ids], int(mask, 16), count)
     return trie
 
+def format_signature_table(stacks):
+    """生成 签名 -> rank范围 的汇总表, rank最多的堆栈排在最前
+
+    Args:
+        stacks: 下标为rank的堆栈字符串列表, 空字符串(没有堆栈)的rank不列出;
+            也可以直接传入group_stacks格式的分组结果
+
+    Returns:
+        表格各行组成的列表
+    """
+    groups = stacks if isinstance(stacks, dict) else group_stacks(stacks)
+    rows = []
+    for stack, mask in groups.items():
+        if not stack:
+            continue
+        frames = [frame for frame in stack.split(";") if frame]
+        leaf = frames[-1] if frames else ""
+        rows.append((bin(mask).count("1"), stack_signature(stack), format_rank_ranges(mask), len(frames), leaf))
+    rows.sort(key=lambda row: -row[0])
+    lines = [f"{'signature':<16}  {'ranks':>6}  {'depth':>5}  rank_ranges  leaf_frame"]
+    for count, signature, ranges, depth, leaf in rows:
+        lines.append(f"{signature:<16}  {count:>6}  {depth:>5}  {ranges}  {leaf}")
+    return lines
+
 def read_file_to_list(file_path):
     """
     读取文件，将每一行作为列表的一个元素。
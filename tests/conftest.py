@@ -0,0 +1,5 @@
+import os
+import sys
+
+# src中的模块以同目录导入的方式互相引用
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
@@ -0,0 +1,69 @@
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmark"))
+from collect_stack_info import StackCollector
+from fake_server import FakeProbingServer
+from synthetic import SyntheticCluster
+
+
+def _cluster(ranks):
+    return SyntheticCluster(ranks=ranks, depth=12, divergence=0.5, variants=3)
+
+
+def test_deadline_bounds_snapshot_when_all_ranks_hang():
+    with FakeProbingServer(_cluster(16), hang_rate=1.0, hang_seconds=3) as server:
+        collector = StackCollector(timeout=10, deadline=0.5, retries=2, hedge_after=0.1)
+        start = time.perf_counter()
+        results = collector.collect_from_multiple_endpoints(server.endpoints())
+        elapsed = time.perf_counter() - start
+    # 时限之外只允许取消请求与关闭连接池的少量开销
+    assert elapsed < 0.5 + 0.2
+    assert [result["status"] for result in results] == ["timeout"] * 16
+    assert [stat["status"] for stat in collector.endpoint_stats] == ["timeout"] * 16
+
+
+def test_failed_ranks_reported_in_rank_order():
+    cluster = _cluster(3)
+    with FakeProbingServer(cluster) as ok, \
+            FakeProbingServer(cluster, hang_rate=1.0, hang_seconds=3) as hung, \
+            FakeProbingServer(cluster, failure_rate=1.0) as failing:
+        endpoints = [ok.endpoints()[0], hung.endpoints()[1], ok.endpoints()[1], failing.endpoints()[2],
+                     ok.endpoints()[2]]
+        collector = StackCollector(timeout=10, deadline=0.5, retries=1, retry_backoff=0.05, keep_locals=True)
+        results = collector.collect_from_multiple_endpoints(endpoints)
+
+    assert results[0] == json.loads(cluster.rank_body(0))
+    assert results[2] == json.loads(cluster.rank_body(1))
+    assert results[4] == json.loads(cluster.rank_body(2))
+    assert results[1]["status"] == "timeout" and results[1]["endpoint"] == endpoints[1]
+    assert results[3]["status"] == "error" and results[3]["endpoint"] == endpoints[3]
+    stats = collector.endpoint_stats
+    assert [stat["status"] for stat in stats] == ["ok", "timeout", "ok", "error", "ok"]
+    assert stats[3]["attempts"] == 2
+    assert stats[1]["latency"] is not None
+
+
+def test_hedged_request_wins_over_hung_attempt():
+    cluster = _cluster(1)
+    with FakeProbingServer(cluster, hang_rate=1.0, hang_seconds=3) as server:
+        collector = StackCollector(timeout=10, deadline=2, retries=0, hedge_after=0.3, keep_locals=True)
+
+        async def collect():
+            task = asyncio.ensure_future(collector.collect_async(server.endpoints()))
+            # 第一次请求已经挂起, 之后的请求(备份请求)正常返回
+            await asyncio.sleep(0.15)
+            server.hang_rate = 0.0
+            return await task
+
+        start = time.perf_counter()
+        results = asyncio.run(collect())
+        elapsed = time.perf_counter() - start
+
+    assert results == [json.loads(cluster.rank_body(0))]
+    assert collector.endpoint_stats[0]["status"] == "ok"
+    assert collector.endpoint_stats[0]["attempts"] == 2
+    assert elapsed < 1.0
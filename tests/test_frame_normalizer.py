@@ -0,0 +1,78 @@
+import pickle
+
+import pytest
+
+from frame_normalizer import FrameNormalizer, collapse_template_args
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("pybind11::cpp_function::initialize<main_0, void>(main_0&&)", "pybind11::cpp_function::initialize<...>(main_0&&)"),
+    ("std::map<int, std::vector<int> >::find(int const&)", "std::map<...>::find(int const&)"),
+    ("f<g<h<int>>, char>::run()", "f<...>::run()"),
+    ("foo<int>::bar<char>()", "foo<...>::bar<...>()"),
+    ("run(std::vector<int>)", "run(std::vector<...>)"),
+    ("f<int(*)(char)>()", "f<...>()"),
+    ("plain_function", "plain_function"),
+])
+def test_collapse_nested_templates(name, expected):
+    assert collapse_template_args(name) == expected
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("operator<", "operator<"),
+    ("Vec::operator<=(Vec const&)", "Vec::operator<=(Vec const&)"),
+    ("Vec::operator<=>(Vec const&)", "Vec::operator<=>(Vec const&)"),
+    ("Stream::operator<< <int>(int)", "Stream::operator<< <...>(int)"),
+    ("Ptr<int>::operator->()", "Ptr<...>::operator->()"),
+    ("Foo<int>::operator()<T>()", "Foo<...>::operator()<...>()"),
+    ("my_operator<int>()", "my_operator<...>()"),
+])
+def test_collapse_keeps_operators(name, expected):
+    assert collapse_template_args(name) == expected
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("foo<(1>2)>()", "foo<...>()"),
+    ("foo<(a<b)>::bar<int>(x)", "foo<...>::bar<...>(x)"),
+    ("f<g<(1>2)>, h<(3)>>()", "f<...>()"),
+])
+def test_collapse_comparisons_in_parentheses(name, expected):
+    assert collapse_template_args(name) == expected
+
+
+@pytest.mark.parametrize("name", ["a<b", "foo<int", "foo<(1>2>()", "f<g<int>()"])
+def test_collapse_unbalanced_returns_name(name):
+    assert collapse_template_args(name) == name
+
+
+def _frame(func, file="/usr/local/src/conda/python-3.10.16/Python/ceval.c", lineno=4200):
+    return {"func": func, "file": file, "lineno": lineno}
+
+
+def test_strip_prefixes_and_drop_lineno():
+    normalizer = FrameNormalizer(strip_prefixes=[r"/usr/local/src/conda/python-[0-9.]+/", "/opt/conda/"],
+                                 drop_lineno=True)
+    assert normalizer.label("CFrame", _frame("_PyEval_EvalFrameDefault")) == \
+        "_PyEval_EvalFrameDefault (Python/ceval.c)"
+    assert normalizer.label("PyFrame", _frame("step", "/opt/conda/lib/train.py", 7)) == "step (lib/train.py)"
+    # 只去掉开头的前缀
+    assert normalizer.label("PyFrame", _frame("step", "/home/opt/conda/train.py", 7)) == \
+        "step (/home/opt/conda/train.py)"
+
+
+def test_templates_collapsed_only_in_c_frames():
+    normalizer = FrameNormalizer(collapse_templates=True)
+    assert normalizer.label("CFrame", _frame("f<int>", "a.cc", 1)) == "f<...> (a.cc:1)"
+    assert normalizer.label("PyFrame", _frame("<module>", "a.py", 1)) == "<module> (a.py:1)"
+
+
+def test_pickle_drops_cache():
+    normalizer = FrameNormalizer(collapse_templates=True, drop_lineno=True, cache_size=16)
+    normalizer.label("CFrame", _frame("f<int>"))
+    normalizer.label("CFrame", _frame("f<int>"))
+    assert normalizer.cache_info().hits == 1
+
+    copy = pickle.loads(pickle.dumps(normalizer))
+    info = copy.cache_info()
+    assert (info.hits, info.misses, info.currsize, info.maxsize) == (0, 0, 0, 16)
+    assert copy.label("CFrame", _frame("f<int>")) == normalizer.label("CFrame", _frame("f<int>"))
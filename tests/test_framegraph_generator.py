@@ -0,0 +1,35 @@
+from framegraph_generator import FlameGraphGenerator
+from tire_stack import StackTrie, merge_stacks
+
+
+def test_builtin_renderer_writes_weighted_folded(tmp_path):
+    folded = tmp_path / "stacks.txt"
+    trie = StackTrie(range(3))
+    trie.insert_mask("main;a;".split(";"), 0b11, count=7)
+    trie.insert_mask("main;b;".split(";"), 0b100, count=2)
+    FlameGraphGenerator(output_file=str(folded)).generate_flamegraph(
+        str(tmp_path / "flamegraph.svg"), trie=trie, weighted=True)
+    counts = sorted(int(line.rsplit(" ", 1)[1]) for line in folded.read_text().splitlines())
+    assert counts == [2, 7]
+
+
+def _frames(*funcs):
+    # 栈顶在前, 与probing的返回一致
+    return [{"PyFrame": {"func": func, "file": "train.py", "lineno": line}}
+            for line, func in enumerate(reversed(funcs))]
+
+
+def test_parallel_merge_matches_serial_merge():
+    branches = [_frames("main", "step", "forward"), _frames("main", "step", "all_reduce"), _frames("main", "eval")]
+    stack_data = [branches[rank % 7 % 3] for rank in range(24)]
+    # workers=3时分为12个分片, 每片2个rank; 失败的rank落在分片边界两侧、首尾与相邻分片
+    for rank in (0, 1, 2, 11, 12, 23):
+        stack_data[rank] = {"error": "timeout", "status": "timeout"}
+
+    serial = FlameGraphGenerator.merge_stack_data(stack_data, workers=1)
+    parallel = FlameGraphGenerator.merge_stack_data(stack_data, workers=3)
+    assert list(parallel.iter_weighted()) == list(serial.iter_weighted())
+    assert parallel.failed_mask == serial.failed_mask == (1 << 0 | 1 << 1 | 1 << 2 | 1 << 11 | 1 << 12 | 1 << 23)
+    stacks = FlameGraphGenerator.stack_data_to_rank_stacks(stack_data)
+    reference = merge_stacks(stacks, FlameGraphGenerator.failed_ranks(stack_data))
+    assert sorted(parallel.iter_weighted()) == sorted(reference.iter_weighted())
@@ -0,0 +1,41 @@
+import os
+
+from framegraph_generator import FlameGraphGenerator
+from metrics import PipelineMetrics
+from tire_stack import merge_stacks
+
+STATS = [
+    {"endpoint": "http://n0/rank/0", "status": "ok", "latency": 0.004, "attempts": 1, "bytes": 100},
+    {"endpoint": "http://n0/rank/1", "status": "ok", "latency": 0.3, "attempts": 2, "bytes": 50},
+    {"endpoint": "http://n0/rank/2", "status": "timeout", "latency": None, "attempts": 1, "bytes": 0},
+]
+
+
+def test_per_endpoint_latency_histograms():
+    metrics = PipelineMetrics()
+    metrics.record_collection(STATS)
+    metrics.record_collection(STATS[:1])
+    data = metrics.to_dict()
+    by_endpoint = data["endpoint_latency_by_endpoint"]
+    assert set(by_endpoint) == {"http://n0/rank/0", "http://n0/rank/1"}
+    assert by_endpoint["http://n0/rank/0"]["count"] == 2
+    assert by_endpoint["http://n0/rank/0"]["counts"][0] == 2
+    assert data["endpoint_latency"]["count"] == 3
+    assert data["bytes"]["response"] == 250
+
+    text = metrics.to_prometheus()
+    assert 'stackdraw_endpoint_latency_seconds_bucket{endpoint="http://n0/rank/1",le="0.25"} 0' in text
+    assert 'stackdraw_endpoint_latency_seconds_bucket{endpoint="http://n0/rank/1",le="0.5"} 1' in text
+    assert 'stackdraw_endpoint_latency_seconds_count{endpoint="http://n0/rank/0"} 2' in text
+
+
+def test_generator_records_output_bytes(tmp_path):
+    metrics = PipelineMetrics()
+    folded = str(tmp_path / "stacks.txt")
+    svg = str(tmp_path / "flamegraph.svg")
+    generator = FlameGraphGenerator(output_file=folded, metrics=metrics)
+    trie = merge_stacks(["main;a;", "main;b;"])
+    generator.generate_flamegraph(svg, trie=trie)
+    generator.write_folded(trie)
+    assert metrics.bytes["svg"] == os.path.getsize(svg)
+    assert metrics.bytes["folded"] == os.path.getsize(folded)
@@ -0,0 +1,47 @@
+import random
+
+from snapshot_diff import SnapshotDiffer
+from tire_stack import merge_stacks, stack_signature
+
+POOL = ["main;train;forward;", "main;train;backward;", "main;train;all_reduce;", "main;eval;", ""]
+
+
+def _weighted(trie):
+    return sorted(trie.iter_weighted())
+
+
+def test_incremental_trie_matches_full_merge():
+    rng = random.Random(0)
+    differ = SnapshotDiffer(16)
+    stacks = [rng.choice(POOL) for _ in range(16)]
+    for _ in range(40):
+        for rank in rng.sample(range(16), 5):
+            stacks[rank] = rng.choice(POOL)
+        differ.update(list(stacks))
+        assert _weighted(differ.trie) == _weighted(merge_stacks(stacks))
+
+
+def test_moved_stuck_and_frames():
+    differ = SnapshotDiffer(3, stuck_threshold=2)
+    a, b = stack_signature("main;a;"), stack_signature("main;b;")
+    first = differ.update(["main;a;", "main;a;", ""])
+    assert first.moved == {0: (None, a), 1: (None, a)}
+    assert sorted(first.appeared_frames) == ["a", "main"]
+
+    second = differ.update(["main;b;", "main;a;", "main;a;"])
+    assert second.moved == {0: (a, b), 2: (None, a)}
+    assert second.appeared_frames == ["b"]
+    assert second.disappeared_frames == []
+    assert second.stuck_ranks == 0
+
+    third = differ.update(["main;b;", "main;a;", ""])
+    assert third.moved == {2: (a, None)}
+    # rank 1 连续两次未变化; rank 0 上一次刚变化过
+    assert third.stuck_ranks == 0b010
+
+    fourth = differ.update(["", "main;a;", ""])
+    assert fourth.moved == {0: (b, None)}
+    assert fourth.disappeared_frames == ["b"]
+    assert fourth.stuck_ranks == 0b010
+    assert fourth.changed_stacks == {"main;b;": [1, 0]}
+    assert _weighted(differ.trie) == _weighted(merge_stacks(["", "main;a;", ""]))
@@ -0,0 +1,49 @@
+import io
+import json
+import os
+
+from framegraph_generator import FlameGraphGenerator
+from snapshot_format import SnapshotReader, write_snapshot
+from tire_stack import group_stacks, merge_stacks
+
+STACKS = ["main;a;", "main;b;", "", "main;a;", ""]
+
+
+def _folded(trie):
+    out = io.StringIO()
+    trie.dump(out)
+    return out.getvalue()
+
+
+def test_round_trip_keeps_failed_ranks(tmp_path):
+    path = str(tmp_path / "snapshot.stk")
+    write_snapshot(path, STACKS, failed_ranks=[2])
+    with SnapshotReader(path) as reader:
+        assert list(reader) == STACKS
+        assert reader.failed_ranks() == [2]
+        assert reader.group_stacks() == group_stacks(STACKS)
+        trie = merge_stacks(reader, reader.failed_ranks())
+    # rank 2 未采集到, rank 4 采集到了但没有堆栈
+    assert trie.failed_mask == 1 << 2
+    assert _folded(trie) == _folded(merge_stacks(STACKS, failed_ranks=[2]))
+    assert "@0/3|1/4|2" in _folded(trie)
+
+
+def test_load_trie_from_snapshot_matches_live_merge(tmp_path):
+    stack_data = [
+        [{"PyFrame": {"file": "train.py", "func": "step", "lineno": 3}},
+         {"PyFrame": {"file": "train.py", "func": "<module>", "lineno": 1}}],
+        {"error": "快照时限已到", "status": "timeout"},
+        [{"PyFrame": {"file": "train.py", "func": "<module>", "lineno": 1}}],
+    ]
+    json_path = str(tmp_path / "stack_data.json")
+    with open(json_path, "w") as f:
+        json.dump(stack_data, f)
+    snapshot_path = str(tmp_path / "snapshot.stk")
+    write_snapshot(snapshot_path, FlameGraphGenerator.stack_data_to_rank_stacks(stack_data),
+                   FlameGraphGenerator.failed_ranks(stack_data))
+
+    live = FlameGraphGenerator(input_json=json_path, output_file=os.devnull).load_trie()
+    reloaded = FlameGraphGenerator(input_json=snapshot_path, output_file=os.devnull).load_trie()
+    assert reloaded.failed_mask == live.failed_mask == 1 << 1
+    assert _folded(reloaded) == _folded(live)
@@ -0,0 +1,121 @@
+import io
+import os
+import random
+
+import pytest
+
+from snapshot_store import SnapshotStore
+from tire_stack import StackTrie
+
+RANKS = 5
+POOL = ["main;step;forward (model.py:1);", "main;step;all_reduce (c10d.py:2);", "main;load;",
+        "main;step;all_reduce (c10d.py:2);wait;", ""]
+
+
+def _samples(count, seed=0):
+    rng = random.Random(seed)
+    stacks = [rng.choice(POOL) for _ in range(RANKS)]
+    samples = []
+    for _ in range(count):
+        stacks = [rng.choice(POOL) if rng.random() < 0.3 else stack for stack in stacks]
+        samples.append(list(stacks))
+    return samples
+
+
+def _fill(path, samples, segment_samples=4):
+    store = SnapshotStore(path, num_ranks=RANKS, segment_samples=segment_samples)
+    for index, stacks in enumerate(samples):
+        store.append(stacks, 1000.0 + index)
+    return store
+
+
+def _folded(trie):
+    out = io.StringIO()
+    trie.dump(out, weighted=True)
+    return sorted(out.getvalue().splitlines())
+
+
+def _expected_trie(samples):
+    groups = {}
+    for stacks in samples:
+        for rank, stack in enumerate(stacks):
+            if stack:
+                group = groups.setdefault(stack, [0, 0])
+                group[0] += 1
+                group[1] |= 1 << rank
+    trie = StackTrie(set(range(RANKS)))
+    for stack, (count, mask) in groups.items():
+        trie.insert_mask(stack.split(";"), mask, count=count)
+    return trie
+
+
+def test_queries_match_samples_across_segments_and_reopen(tmp_path):
+    samples = _samples(23)
+    path = str(tmp_path / "store")
+    _fill(path, samples[:10]).close()
+    store = SnapshotStore(path, num_ranks=RANKS)
+    for index, stacks in enumerate(samples[10:], 10):
+        store.append(stacks, 1000.0 + index)
+
+    for first, stop in [(0, 23), (3, 9), (5, 6), (8, 20)]:
+        assert _folded(store.aggregate(1000.0 + first, 1000.0 + stop - 1)) == \
+            _folded(_expected_trie(samples[first:stop]))
+    for index, stacks in enumerate(samples):
+        assert store.stacks_at(1000.0 + index) == stacks
+
+    for run in store.dwell("all_reduce", 2):
+        rank, first, last = run["rank"], int(run["start"]) - 1000, int(run["end"]) - 1000
+        assert run["samples"] == last - first + 1 >= 2
+        assert all("all_reduce" in samples[index][rank] for index in range(first, last + 1))
+        assert first == 0 or "all_reduce" not in samples[first - 1][rank]
+        assert last == len(samples) - 1 or "all_reduce" not in samples[last + 1][rank]
+    store.close()
+
+
+def test_rejects_out_of_order_timestamps(tmp_path):
+    store = _fill(str(tmp_path / "store"), _samples(2))
+    with pytest.raises(ValueError):
+        store.append(POOL[:RANKS], 999.0)
+    store.close()
+
+
+def test_reopen_after_torn_symbol_log(tmp_path):
+    path = str(tmp_path / "store")
+    samples = _samples(6)
+    store = _fill(path, samples)
+    # 最后一个样本引入了新的帧与堆栈
+    store.append(["main;step;new_frame (model.py:9);"] + samples[-1][1:], 1006.0)
+    store.close()
+    symbol_log = os.path.join(path, "symbols.log")
+    with open(symbol_log, "r+b") as f:
+        f.truncate(os.path.getsize(symbol_log) - 6)
+
+    store = SnapshotStore(path)
+    assert len(store) == len(samples)
+    assert store.stacks_at() == samples[-1]
+    assert _folded(store.aggregate()) == _folded(_expected_trie(samples))
+    # 恢复后可以继续写入, 丢失的帧重新记录
+    store.append(["main;step;new_frame (model.py:9);"] + samples[-1][1:], 1006.0)
+    store.close()
+    store = SnapshotStore(path)
+    assert store.stacks_at()[0] == "main;step;new_frame (model.py:9);"
+    store.close()
+
+
+def test_reopen_after_torn_tails(tmp_path):
+    path = str(tmp_path / "store")
+    samples = _samples(9)
+    _fill(path, samples).close()
+    with open(os.path.join(path, "samples.log"), "ab") as f:
+        f.write(b"\1\2\3")
+    with open(os.path.join(path, "changes.log"), "ab") as f:
+        f.write(b"\1" * 16)
+    with open(os.path.join(path, "stacks.log"), "ab") as f:
+        f.write(b"\5\0\0\0\1")
+    # 写满后还没来得及生成索引的段
+    os.remove(os.path.join(path, "segments", "000001.seg"))
+
+    store = SnapshotStore(path)
+    assert len(store) == len(samples)
+    assert _folded(store.aggregate()) == _folded(_expected_trie(samples))
+    store.close()
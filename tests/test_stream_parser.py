@@ -0,0 +1,69 @@
+import json
+
+import pytest
+
+from stream_parser import FrameStreamParser, parse_frames
+
+FRAMES = [
+    {"CFrame": {"ip": "0x7f00", "file": "/usr/lib/libc.so.6", "func": "clone3", "lineno": 0}},
+    {"PyFrame": {"file": "/opt/训练/model.py", "func": "forward_前向", "lineno": 42,
+                 "locals": {"x": {"id": 1, "class": "torch.Tensor", "value": "tensor([1., 2.]) \"引号\" ]}{,"},
+                            "emoji": {"value": "🔥 "}}}},
+    {"CFrame": {"ip": "0x7f01", "file": "", "func": "operator<<(std::ostream&, c10::IValue const&)",
+                "lineno": 0}},
+]
+
+
+def _expected(keep_locals=False):
+    frames = json.loads(json.dumps(FRAMES))
+    if not keep_locals:
+        frames[1]["PyFrame"].pop("locals")
+    return frames
+
+
+@pytest.mark.parametrize("ensure_ascii", [True, False])
+def test_every_chunk_split(ensure_ascii):
+    body = json.dumps(FRAMES, ensure_ascii=ensure_ascii, indent=1).encode("utf-8")
+    for split in range(1, len(body)):
+        assert parse_frames([body[:split], body[split:]]) == _expected()
+
+
+def test_single_byte_chunks_split_multibyte_characters():
+    body = json.dumps(FRAMES, ensure_ascii=False).encode("utf-8")
+    chunks = [body[i:i + 1] for i in range(len(body))]
+    assert parse_frames(chunks) == _expected()
+    assert parse_frames(chunks, keep_locals=True) == _expected(keep_locals=True)
+
+
+def test_frames_are_emitted_as_soon_as_complete():
+    parser = FrameStreamParser()
+    text = json.dumps(FRAMES)
+    first_end = text.index("}}") + 2
+    assert parser.feed(text[:first_end]) == _expected()[:1]
+    assert parser.feed(text[first_end:]) == _expected()[1:]
+    assert parser.close() == []
+
+
+def test_empty_list():
+    assert parse_frames([b" [ ] \n"]) == []
+
+
+@pytest.mark.parametrize("body", [
+    b"",
+    b'{"CFrame": {}}',
+    b"[1, 2]",
+    b'[{"CFrame": {}},]',
+    b'[{"CFrame": {}} {"CFrame": {}}]',
+    b'[{"CFrame": {}}',
+    b'[{"CFrame": {"func": "trunc',
+    b'[{"CFrame": {}}] trailing',
+    b"[,]",
+])
+def test_malformed_input_raises(body):
+    with pytest.raises(ValueError):
+        parse_frames([body])
+
+
+def test_invalid_utf8_raises():
+    with pytest.raises(ValueError):
+        parse_frames([b'[{"CFrame": {"func": "\xff"}}]'])
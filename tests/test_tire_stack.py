@@ -0,0 +1,47 @@
+import pytest
+
+import snapshot_diff
+from snapshot_diff import SnapshotDiffer
+from tire_stack import merge_partials, merge_stacks, parse_rank_ranges, stacks_to_partial
+
+
+def _partials():
+    return [stacks_to_partial(["a;b;", "a;c;"], [0, 1]),
+            stacks_to_partial(["a;b;", ""], [2, 3], failed_ranks=[3])]
+
+
+def test_merge_partials_marks_ranks_of_missing_partials_failed():
+    trie = merge_partials(_partials(), all_ranks=range(6))
+    assert trie.all_ranks == set(range(6))
+    assert trie.failed_mask == 0b111000
+
+
+def test_merge_partials_without_layout_uses_reported_ranks():
+    trie = merge_partials(_partials())
+    assert trie.all_ranks == {0, 1, 2, 3}
+    assert trie.failed_mask == 0b1000
+
+
+def test_compact_symbols_drops_removed_frames():
+    trie = merge_stacks(["a;b;", "a;c;", "a;b;"])
+    trie.remove_mask("a;c;".split(";"), 0b10)
+    before = list(trie)
+    assert trie.compact_symbols() == 1
+    assert sorted(trie.symbols) == ["", "a", "b"]
+    assert list(trie) == before
+
+
+def test_differ_compacts_symbols_and_clears_labels(monkeypatch):
+    monkeypatch.setattr(snapshot_diff, "COMPACT_MIN_SYMBOLS", 8)
+    differ = SnapshotDiffer(2)
+    for step in range(50):
+        stacks = [f"main;step_{step};", "main;wait;"]
+        differ.update(stacks)
+        assert sorted(differ.trie) == sorted(merge_stacks(stacks))
+    assert len(differ.trie.symbols) <= 8
+
+
+def test_parse_rank_ranges_rejects_ranks_beyond_cluster():
+    assert parse_rank_ranges("0-3/6", num_ranks=8) == 0b1001111
+    with pytest.raises(ValueError):
+        parse_rank_ranges("0-1000000000", num_ranks=8)